@@ -0,0 +1,364 @@
+import argparse
+import datetime
+import json
+import mmap
+import os
+import re
+import sqlite3
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from .pipeline import PIPELINE_METHODS
+from .private_api import parse_attendance_status, parse_schedule_exams, parse_result
+from .utils import parse_result_data
+
+
+# Endpoint -> parser run by reparse, the web pages of the pipeline plus the APP API replies
+ARCHIVE_PARSERS = dict(
+    {method: parser for method, (_, parser) in PIPELINE_METHODS.items()},
+    get_result_data_web=parse_result_data,
+    get_attendance_status=parse_attendance_status,
+    get_schedule_exams=parse_schedule_exams,
+    get_result_by_exam_id=parse_result,
+)
+
+# Places where a response can echo a password: the password inputs of the login form, their
+# hidden field updates in ASP.NET delta responses, and password keys of JSON replies
+_SECRET_PATTERNS = [
+    re.compile(rb'(<input[^>]*\bname="(?:txtPassword|hdnPassword)"[^>]*\bvalue=")([^"]*)(")'),
+    re.compile(rb'(<input[^>]*\bvalue=")([^"]*)("[^>]*\bname="(?:txtPassword|hdnPassword)")'),
+    re.compile(rb'(\|hiddenField\|(?:txtPassword|hdnPassword)\|)([^|]*)(\|)'),
+    re.compile(rb'("[A-Za-z0-9_]*(?i:password)"\s*:\s*")((?:[^"\\]|\\.)*)(")'),
+]
+
+
+INDEX_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS responses (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    fetched_at TEXT NOT NULL,
+    segment INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    raw_length INTEGER NOT NULL,
+    crc32 INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_account ON responses (account, endpoint, fetched_at);
+CREATE INDEX IF NOT EXISTS idx_responses_endpoint ON responses (endpoint, fetched_at);
+'''
+
+
+def scrub(data):
+    '''
+    Mask the values of password fields echoed in a response with '*' characters of the same length,
+    so length prefixed formats like ASP.NET delta responses stay readable. The rest of the response
+    is left untouched, session cookies are never part of the archived bodies.
+
+    Args:
+        data (bytes): The raw response.
+    '''
+    for pattern in _SECRET_PATTERNS:
+        data = pattern.sub(lambda m: m.group(1) + b"*" * len(m.group(2)) + m.group(3), data)
+    return data
+
+
+def _parse_blob(method, blob):
+    # Runs in the process pool, decompressing there keeps the reading side cheap
+    return ARCHIVE_PARSERS[method](zlib.decompress(blob))
+
+
+class ResponseArchive:
+    '''
+    Append-only archive of raw responses, so parsed history can be rebuilt without fetching again.
+
+    Responses are compressed with zlib and appended to numbered segment files. A SQLite index holds
+    the account, endpoint, fetch time and position of every response, and responses are read back
+    through memory maps of the segments. A segment is closed once it grows beyond segment_size and
+    is never modified afterwards.
+
+    Password fields echoed in a response are masked, see scrub. The archive still holds personal data,
+    so its directory is created readable by the owner only.
+
+    Pass an archive to CharusatScraper (archive=...) or pipeline.harvest to record the responses of
+    the fetch_* methods, and use reparse to run the current parsers over the recorded responses.
+    '''
+
+    def __init__(self, path="archive", segment_size=64 * 1024 * 1024, level=6):
+        '''
+        Args:
+            path (str): Directory of the segment files and the index, created if it doesn't exist.
+            segment_size (int): Size in bytes after which a new segment file is started.
+            level (int): zlib compression level.
+        '''
+        self.path = path
+        self.segment_size = segment_size
+        self.level = level
+        os.makedirs(path, mode=0o700, exist_ok=True)
+
+        self.conn = sqlite3.connect(os.path.join(path, "index.sqlite"), check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(INDEX_SCHEMA)
+        self._lock = threading.RLock()
+        self._maps = {}
+
+        segments = self.segments()
+        self._segment = segments[-1] if segments else 1
+        self._file = open(self._segment_path(self._segment), "ab")
+
+    def _segment_path(self, segment):
+        return os.path.join(self.path, "segment-{:06d}.bin".format(segment))
+
+    def segments(self):
+        '''
+        Return the numbers of the existing segment files in order.
+        '''
+        return sorted(
+            int(name[len("segment-"):-len(".bin")]) for name in os.listdir(self.path)
+            if name.startswith("segment-") and name.endswith(".bin"))
+
+    def close(self):
+        with self._lock:
+            for segment_map in self._maps.values():
+                segment_map.close()
+            self._maps.clear()
+            self._file.close()
+            self.conn.close()
+
+    def append(self, account, endpoint, data, fetched_at=None):
+        '''
+        Compress and append one raw response.
+
+        Args:
+            account (str): The username the response belongs to.
+            endpoint (str): The scraper method the response is for, e.g. "get_attendance".
+            data (bytes): The raw response.
+            fetched_at (str, optional): ISO timestamp of the fetch. Defaults to now.
+
+        Returns:
+            int: The id of the archived response.
+        '''
+        data = scrub(data)
+        blob = zlib.compress(data, self.level)
+        fetched_at = fetched_at or datetime.datetime.now().isoformat(timespec="seconds")
+
+        with self._lock:
+            if self._file.tell() >= self.segment_size:
+                self._file.close()
+                self._segment += 1
+                self._file = open(self._segment_path(self._segment), "ab")
+
+            offset = self._file.tell()
+            self._file.write(blob)
+            # Flushed before indexing, so every indexed response is readable through a memory map
+            self._file.flush()
+
+            with self.conn:
+                cursor = self.conn.execute(
+                    "INSERT INTO responses (account, endpoint, fetched_at, segment, offset, length, raw_length, crc32) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (account, endpoint, fetched_at, self._segment, offset, len(blob), len(data), zlib.crc32(data)))
+            return cursor.lastrowid
+
+    def records(self, account=None, endpoint=None, since=None, until=None):
+        '''
+        Return the index entries of archived responses, oldest first.
+
+        Args:
+            account (str, optional): Only return responses of this username.
+            endpoint (str or iterable, optional): Only return responses of these endpoints.
+            since (str, optional): Only return responses fetched at or after this ISO date or timestamp.
+            until (str, optional): Only return responses fetched before this ISO date or timestamp.
+        '''
+        sql = "SELECT * FROM responses WHERE 1 = 1"
+        params = []
+        if account is not None:
+            sql += " AND account = ?"
+            params.append(account)
+        if endpoint is not None:
+            endpoints = [endpoint] if isinstance(endpoint, str) else list(endpoint)
+            sql += " AND endpoint IN ({})".format(", ".join("?" * len(endpoints)))
+            params.extend(endpoints)
+        if since is not None:
+            sql += " AND fetched_at >= ?"
+            params.append(since)
+        if until is not None:
+            sql += " AND fetched_at < ?"
+            params.append(until)
+        with self._lock:
+            return [dict(row) for row in self.conn.execute(sql + " ORDER BY fetched_at, id", params)]
+
+    def _map(self, segment, end):
+        # Segments only grow, so a map is replaced once a record lies beyond its end
+        with self._lock:
+            segment_map = self._maps.get(segment)
+            if segment_map is None or len(segment_map) < end:
+                if segment_map is not None:
+                    segment_map.close()
+                with open(self._segment_path(segment), "rb") as f:
+                    segment_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                self._maps[segment] = segment_map
+            return segment_map
+
+    def read_compressed(self, record):
+        '''
+        Return the compressed bytes of an index entry as stored in its segment.
+        '''
+        end = record["offset"] + record["length"]
+        # Another thread may close the map while replacing it, so it is sliced under the lock
+        with self._lock:
+            return self._map(record["segment"], end)[record["offset"]:end]
+
+    def read(self, record):
+        '''
+        Return the raw response of an index entry.
+
+        Raises:
+            ValueError: If the stored response is corrupted.
+        '''
+        data = zlib.decompress(self.read_compressed(record))
+        if zlib.crc32(data) != record["crc32"]:
+            raise ValueError("Archived response {} is corrupted".format(record["id"]))
+        return data
+
+    def stats(self):
+        '''
+        Return the number of responses and segments and the raw and compressed sizes in bytes.
+        '''
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(raw_length), 0), COALESCE(SUM(length), 0) FROM responses").fetchone()
+        return {"responses": row[0], "raw_bytes": row[1], "stored_bytes": row[2], "segments": len(self.segments())}
+
+
+def reparse(archive, endpoints=None, account=None, since=None, until=None, workers=None):
+    '''
+    Run the current parsers over archived responses in a process pool.
+
+    Only endpoints with a parser in ARCHIVE_PARSERS can be parsed again.
+
+    Args:
+        archive (ResponseArchive): The archive to read.
+        endpoints (iterable, optional): Endpoints to parse again. Defaults to all of ARCHIVE_PARSERS.
+        account, since, until: Filters as in ResponseArchive.records.
+        workers (int, optional): Number of parser processes. Defaults to the number of CPUs.
+
+    Yields:
+        dict: One entry per archived response, in archive order, with the keys
+            - 'id': The id of the archived response
+            - 'username': The account the data belongs to
+            - 'method': The endpoint, a scraper method name
+            - 'fetched_at': ISO timestamp of the original fetch
+            - 'data': The parsed data, or None on failure
+            - 'error': The exception raised while parsing, or None
+
+    Raises:
+        ValueError: If an endpoint has no parser.
+    '''
+    endpoints = list(endpoints or ARCHIVE_PARSERS)
+    for endpoint in endpoints:
+        if endpoint not in ARCHIVE_PARSERS:
+            raise ValueError("Endpoint '{}' has no parser".format(endpoint))
+
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = 2 * workers
+    pending = []
+
+    def result(record, future):
+        error = future.exception()
+        return {
+            "id": record["id"],
+            "username": record["account"],
+            "method": record["endpoint"],
+            "fetched_at": record["fetched_at"],
+            "data": None if error else future.result(),
+            "error": error
+        }
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for record in archive.records(account=account, endpoint=endpoints, since=since, until=until):
+            pending.append((record, executor.submit(_parse_blob, record["endpoint"], archive.read_compressed(record))))
+            # Keep results in archive order while bounding the responses held in memory
+            if len(pending) >= max_in_flight:
+                wait([pending[0][1]], return_when=FIRST_COMPLETED)
+                yield result(*pending.pop(0))
+        for record, future in pending:
+            yield result(record, future)
+
+
+# Endpoints whose archived responses can be saved into a HarvestStore besides those of HarvestStore.save
+_REPARSE_SAVED = ("get_attendance", "get_fees_details", "get_result_by_exam_id")
+
+
+def _can_save_reparsed(store, method):
+    return method in _REPARSE_SAVED or store.can_save(method)
+
+
+def _save_reparsed(store, record):
+    snapshot_date = record["fetched_at"][:10]
+    if record["method"] == "get_attendance":
+        store.save_attendance(record["username"], record["data"], snapshot_date=snapshot_date)
+    elif record["method"] == "get_fees_details":
+        store.save_fees(record["username"], record["data"], snapshot_date=snapshot_date)
+    elif record["method"] == "get_result_by_exam_id":
+        store.save_result(record["username"], record["data"])
+    else:
+        store.save(record["method"], record["username"], record["data"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Raw response archive of the CHARUSAT scraper")
+    parser.add_argument("--path", default="archive", help="Directory of the archive")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    commands.add_parser("stats", help="Show the size of the archive")
+
+    reparse_parser = commands.add_parser("reparse", help="Run the current parsers over archived responses")
+    reparse_parser.add_argument("--endpoint", action="append", help="Endpoint to parse again, can be repeated")
+    reparse_parser.add_argument("--account")
+    reparse_parser.add_argument("--since")
+    reparse_parser.add_argument("--until")
+    reparse_parser.add_argument("--workers", type=int)
+    reparse_parser.add_argument("--store", help="Save the parsed data into this HarvestStore database instead of printing it")
+    args = parser.parse_args()
+
+    archive = ResponseArchive(args.path)
+    try:
+        if args.command == "stats":
+            print(json.dumps(archive.stats()))
+            return
+
+        store = None
+        if args.store:
+            from .storage import HarvestStore
+            store = HarvestStore(args.store)
+
+        parsed = skipped = failed = 0
+        for record in reparse(archive, args.endpoint, args.account, args.since, args.until, args.workers):
+            if record["error"] is not None:
+                failed += 1
+                print(json.dumps({"id": record["id"], "method": record["method"], "error": str(record["error"])}))
+                continue
+            if store is not None:
+                # Endpoints without a table, such as get_user_details, are counted but not saved
+                if not _can_save_reparsed(store, record["method"]):
+                    skipped += 1
+                    continue
+                _save_reparsed(store, record)
+                parsed += 1
+            else:
+                parsed += 1
+                record.pop("error")
+                print(json.dumps(record))
+
+        if store is not None:
+            print(json.dumps({"parsed": parsed, "skipped": skipped, "failed": failed}))
+            store.close()
+    finally:
+        archive.close()
+
+
+if __name__ == "__main__":
+    main()
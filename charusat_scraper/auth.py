@@ -0,0 +1,112 @@
+import hashlib
+import threading
+import time
+from .errors import MissingCredentialsError, InvalidCredentialsError
+
+
+class _LoginCall:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class LoginCoordinator:
+    '''
+    Coordinates logins so that each account logs in at most once at a time.
+
+    Concurrent logins for the same account and host are coalesced: the first caller performs the
+    login and the others wait for it and receive the same result. Logins that fail because of
+    missing or invalid credentials are remembered for a cooldown period, during which further
+    attempts for the same username and password on the same host fail immediately without
+    contacting the server. Other hosts, e.g. a mock server, don't share logins or failures.
+    '''
+
+    def __init__(self, cooldown=300):
+        '''
+        Args:
+            cooldown (float): Seconds a failed login is remembered for.
+        '''
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._failures = {}
+
+    @staticmethod
+    def account_key(username, password):
+        '''
+        Return the key identifying an account, the password is only kept as a hash.
+        '''
+        return (username, hashlib.sha256(str(password).encode("utf-8")).hexdigest())
+
+    def login(self, kind, username, password, login_func, host=None):
+        '''
+        Run login_func for an account unless a login of the same kind is already running.
+
+        Args:
+            kind (str): The kind of login, e.g. "web" or "app", logins of different kinds are not coalesced.
+            username (str): The username of the account.
+            password (str): The password of the account.
+            login_func (callable): Performs the login and returns its result.
+            host (str, optional): The host logged in to, e.g. "charusat.edu.in:912".
+
+        Returns:
+            The result of login_func, possibly from a login started by another caller.
+
+        Raises:
+            InvalidCredentialsError: If the credentials failed within the cooldown period.
+            Exception: Any exception raised by login_func.
+        '''
+        account = (host,) + self.account_key(username, password)
+        key = (kind,) + account
+
+        with self._lock:
+            failure = self._failures.get(account)
+            if failure is not None:
+                expires, error = failure
+                if expires > time.monotonic():
+                    raise InvalidCredentialsError(
+                        "Login recently failed for these credentials ({}). Not retrying until the cooldown ends.".format(error))
+                del self._failures[account]
+
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _LoginCall()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = login_func()
+            return call.result
+        except (MissingCredentialsError, InvalidCredentialsError) as e:
+            call.error = e
+            with self._lock:
+                self._failures[account] = (time.monotonic() + self.cooldown, e)
+            raise
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.done.set()
+
+    def clear_failures(self, username=None, password=None):
+        '''
+        Forget remembered login failures, for one account on every host if credentials are given or for all accounts.
+        '''
+        with self._lock:
+            if username is None:
+                self._failures.clear()
+            else:
+                account = self.account_key(username, password)
+                for key in [key for key in self._failures if key[1:] == account]:
+                    del self._failures[key]
+
+
+default_coordinator = LoginCoordinator()
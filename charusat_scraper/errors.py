@@ -2,4 +2,25 @@ class MissingCredentialsError(Exception):
     '''
     Exception raised for missing credentials.
     '''
+    pass
+
+
+class InvalidCredentialsError(ValueError):
+    '''
+    Exception raised when the server rejects the credentials.
+    '''
+    pass
+
+
+class SessionExpiredError(Exception):
+    '''
+    Exception raised when the server redirects to the login page because the session expired.
+    '''
+    pass
+
+
+class ResultNotFoundError(LookupError):
+    '''
+    Exception raised when no result is published for the requested semester or month_year.
+    '''
     pass
\ No newline at end of file
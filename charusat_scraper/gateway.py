@@ -0,0 +1,219 @@
+import argparse
+import asyncio
+import inspect
+import json
+import time
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from .scraper import CharusatScraper
+from .auth import LoginCoordinator
+from .errors import MissingCredentialsError, InvalidCredentialsError, SessionExpiredError, ResultNotFoundError
+from .ratelimit import current_limits
+from .session_pool import SessionPool
+
+
+# Scraper methods exposed by the gateway, as POST /<method>
+GATEWAY_METHODS = (
+    "get_user_details",
+    "get_attendance",
+    "get_attendance_status",
+    "get_fees_details",
+    "get_result_data",
+)
+
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 405: "Method Not Allowed", 502: "Bad Gateway"}
+
+
+class Gateway:
+    '''
+    Local HTTP gateway that serves the scraper methods as JSON endpoints to several consumers.
+
+    The gateway leases logged in scrapers from a SessionPool, merges identical concurrent
+    requests into a single upstream call and serves results from memory for cache_ttl seconds,
+    so the university servers only see traffic for unique data.
+
+    Requests are POST /<method> with a JSON body {"username": ..., "password": ..., "args": {...}},
+    where args are the keyword arguments of the scraper method, e.g. {"date": "22/09/2023"}.
+    GET /limits returns the current rate limits.
+    '''
+
+    def __init__(self, cache_ttl=300, session_ttl=1200, max_workers=8, scraper_class=CharusatScraper, pool=None):
+        '''
+        Args:
+            cache_ttl (float): Seconds a result is served from memory.
+            session_ttl (float): Seconds a logged in session is kept before logging in again, at most the server's 20 minute session timeout.
+            max_workers (int): Number of threads running upstream calls.
+            scraper_class (type): Class used to log in accounts, called with thread_safe=True.
+            pool (SessionPool, optional): Pool of logged in scrapers. Defaults to one built from scraper_class and session_ttl.
+        '''
+        self.cache_ttl = cache_ttl
+        self.session_ttl = session_ttl
+        self.scraper_class = scraper_class
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.pool = pool or SessionPool(
+            factory=lambda username, password: scraper_class(username, password, thread_safe=True),
+            ttl=session_ttl)
+        self._in_flight = {}
+        self._cache = {}
+
+    def check_args(self, method, args):
+        '''
+        Check that args are valid keyword arguments of a scraper method.
+
+        Raises:
+            TypeError: If the method doesn't accept the arguments.
+        '''
+        self._signature(method).bind(None, **args)
+
+    def _signature(self, method):
+        # scraper_class may also be a factory function, then the CharusatScraper signatures apply
+        return inspect.signature(getattr(self.scraper_class, method, None) or getattr(CharusatScraper, method))
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, lambda: func(*args, **kwargs))
+
+    async def _call_upstream(self, username, password, method, args):
+        # The pool logs each account in once, the scraper itself then serves concurrent calls
+        scraper = await self._run(self.pool.acquire, username, password)
+        try:
+            return await self._run(getattr(scraper, method), **args)
+        except (SessionExpiredError, requests.RequestException):
+            # Bad values or missing data don't say anything about the session, so it is only dropped here
+            self.pool.invalidate(username, password, scraper)
+            raise
+        finally:
+            self.pool.release(username, password)
+
+    async def call(self, username, password, method, args=None):
+        '''
+        Return the result of a scraper method, from the cache, from an identical running call, or from upstream.
+
+        Raises:
+            TypeError: If the method doesn't accept args, before anything is sent upstream.
+        '''
+        args = args or {}
+        self.check_args(method, args)
+        account = LoginCoordinator.account_key(username, password)
+        key = (account, method, json.dumps(args, sort_keys=True))
+
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._call_upstream(username, password, method, args))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda task: self._finish(key, task))
+
+        # Shielded so that a disconnecting client doesn't cancel the call for everyone waiting on it
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        del self._in_flight[key]
+        if not task.cancelled() and task.exception() is None:
+            self._cache[key] = (time.monotonic() + self.cache_ttl, task.result())
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for key in [key for key, value in self._cache.items() if value[0] <= now]:
+            del self._cache[key]
+
+    async def handle(self, method, path, body):
+        '''
+        Handle one HTTP request and return (status, response data).
+        '''
+        name = path.strip("/").split("?")[0]
+
+        if name == "limits":
+            return 200, current_limits()
+        if name not in GATEWAY_METHODS:
+            return 404, {"error": "Unknown method '{}'".format(name)}
+        if method != "POST":
+            return 405, {"error": "Use POST"}
+
+        try:
+            request = json.loads(body or b"{}")
+            username = request["username"]
+            password = request["password"]
+            args = request.get("args") or {}
+            self.check_args(name, args)
+        except (ValueError, KeyError, TypeError):
+            return 400, {"error": "Expected a JSON body with 'username', 'password' and optional 'args' of {}{}".format(
+                name, self._signature(name))}
+
+        try:
+            return 200, await self.call(username, password, name, args)
+        except (MissingCredentialsError, InvalidCredentialsError) as e:
+            return 401, {"error": str(e)}
+        except ResultNotFoundError as e:
+            return 404, {"error": str(e)}
+        except ValueError as e:
+            return 400, {"error": str(e)}
+        except Exception as e:
+            return 502, {"error": str(e)}
+
+    async def _serve_client(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+
+            if len(request_line) < 2:
+                status, data = 400, {"error": "Malformed request"}
+            else:
+                length = int(headers.get("content-length", 0))
+                body = await reader.readexactly(length) if length else b""
+                status, data = await self.handle(request_line[0], request_line[1], body)
+
+            payload = json.dumps(data).encode("utf-8")
+            writer.write(
+                "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\nContent-Length: {}\r\nConnection: close\r\n\r\n".format(
+                    status, STATUS_TEXT.get(status, ""), len(payload)).encode("latin-1") + payload)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        '''
+        Serve the gateway until cancelled.
+        '''
+        server = await asyncio.start_server(self._serve_client, host, port)
+        try:
+            while True:
+                await asyncio.sleep(60)
+                self._evict_expired()
+        finally:
+            server.close()
+            await server.wait_closed()
+            self.pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local caching gateway for the CHARUSAT scraper")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cache-ttl", type=float, default=300)
+    parser.add_argument("--session-ttl", type=float, default=1200)
+    args = parser.parse_args()
+
+    gateway = Gateway(cache_ttl=args.cache_ttl, session_ttl=args.session_ttl)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(gateway.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
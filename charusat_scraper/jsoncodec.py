@@ -0,0 +1,120 @@
+import json
+from typing import Any, List, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def _json_loads(data):
+    return json.loads(data)
+
+
+def _orjson_loads(data):
+    return orjson.loads(data)
+
+
+def _msgspec_loads(data):
+    try:
+        return msgspec.json.decode(data)
+    except msgspec.DecodeError as e:
+        raise json.JSONDecodeError(str(e), "", 0)
+
+
+BACKENDS = {"json": _json_loads}
+if orjson is not None:
+    BACKENDS["orjson"] = _orjson_loads
+if msgspec is not None:
+    BACKENDS["msgspec"] = _msgspec_loads
+
+# Fastest available backend first
+backend = "orjson" if orjson is not None else "msgspec" if msgspec is not None else "json"
+
+
+def set_backend(name):
+    '''
+    Select the JSON backend used by loads, one of "orjson", "msgspec" or "json".
+
+    Raises:
+        ValueError: If the backend is not installed.
+    '''
+    global backend
+    if name not in BACKENDS:
+        raise ValueError("JSON backend '{}' is not available, installed backends: {}".format(name, ", ".join(BACKENDS)))
+    backend = name
+
+
+def loads(data):
+    '''
+    Decode a JSON document given as bytes or str with the selected backend.
+
+    Raises:
+        json.JSONDecodeError: If the document is not valid JSON.
+    '''
+    return BACKENDS[backend](data)
+
+
+class Schema:
+    '''
+    Selective decoder for APP API replies.
+
+    Only the listed tables and fields are kept, under new names. With msgspec installed the
+    reply is decoded straight into typed structs holding just these fields, so the rest of the
+    reply is never materialized. Otherwise it is decoded with loads and the fields are picked out.
+    Missing fields default to "".
+
+    Example:
+        Schema({"tblScheduleExam": {"ScheduleExamID": "scheduleExamID"}}).decode(response.content)
+        # {"tblScheduleExam": [{"scheduleExamID": 1234}, ...]}
+    '''
+
+    def __init__(self, tables):
+        '''
+        Args:
+            tables (dict): Table name -> {field name in the reply: key in the decoded rows}.
+        '''
+        self.tables = tables
+        self._decoder = None
+
+        if msgspec is not None and all(field.isidentifier() for fields in tables.values() for field in fields):
+            table_fields = []
+            for table, fields in tables.items():
+                row_type = msgspec.defstruct(
+                    "{}Row".format(table), [(field, Any, "") for field in fields])
+                table_fields.append((table, Optional[List[row_type]], None))
+            self._decoder = msgspec.json.Decoder(msgspec.defstruct("Reply", table_fields))
+
+    def decode(self, data):
+        '''
+        Decode a reply given as bytes or str.
+
+        Returns:
+            dict: Table name -> list of dictionaries with the renamed fields.
+
+        Raises:
+            json.JSONDecodeError: If the reply is not valid JSON or doesn't match the schema.
+        '''
+        if self._decoder is not None:
+            try:
+                reply = self._decoder.decode(data)
+            except (msgspec.DecodeError, msgspec.ValidationError) as e:
+                raise json.JSONDecodeError(str(e), "", 0)
+            return {
+                table: [{key: getattr(row, field) for field, key in fields.items()} for row in getattr(reply, table) or []]
+                for table, fields in self.tables.items()
+            }
+
+        reply = loads(data)
+        try:
+            return {
+                table: [{key: row.get(field, "") for field, key in fields.items()} for row in reply.get(table) or []]
+                for table, fields in self.tables.items()
+            }
+        except (AttributeError, TypeError):
+            raise json.JSONDecodeError("Reply doesn't match the schema", "", 0)
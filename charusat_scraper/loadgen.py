@@ -0,0 +1,171 @@
+import argparse
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from .scraper import CharusatScraper
+from .mock_server import MockEGovServer, MockConfig
+from .ratelimit import configure_host, get_limiter
+
+
+DEFAULT_METHODS = ("get_attendance", "get_fees_details", "get_attendance_status")
+
+
+def percentile(values, pct):
+    '''
+    Return the pct-th percentile (0-100) of values using the nearest-rank method, or None if empty.
+    '''
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(0, min(len(values) - 1, int(math.ceil(pct / 100.0 * len(values))) - 1))
+    return values[rank]
+
+
+def _harvest_account(username, password, base_url, private_base_url, methods, scraper_class):
+    timings = {}
+    start = time.monotonic()
+    scraper = scraper_class(username, password, base_url=base_url, private_base_url=private_base_url)
+    timings["login"] = time.monotonic() - start
+    for method in methods:
+        method_start = time.monotonic()
+        getattr(scraper, method)()
+        timings[method] = time.monotonic() - method_start
+    return time.monotonic() - start, timings
+
+
+def run_level(concurrency, accounts, base_url, private_base_url=None, password="password", methods=DEFAULT_METHODS, scraper_class=CharusatScraper):
+    '''
+    Harvest a number of accounts at a fixed concurrency and measure throughput and latency.
+
+    Args:
+        concurrency (int): Number of accounts harvested at the same time.
+        accounts (int): Number of accounts harvested in total.
+        base_url (str): Base URL of the eGovernance website, e.g. of a MockEGovServer.
+        private_base_url (str, optional): Base URL of the APP API. Defaults to base_url.
+        password (str): Password of the generated accounts.
+        methods (iterable): Scraper methods called for each account after logging in.
+        scraper_class (type): Class used to log in the accounts.
+
+    Returns:
+        dict: The measurements with the keys
+            - 'concurrency', 'accounts', 'errors': The level, accounts harvested and accounts that failed
+            - 'duration': Wall time in seconds
+            - 'requests', 'requests_per_second': HTTP requests sent and their rate
+            - 'accounts_per_second': Harvested accounts per second
+            - 'latency': {'account' or operation name: {'p50', 'p90', 'p99'}} in seconds
+    '''
+    private_base_url = private_base_url or base_url
+    hosts = {urlsplit(base_url).netloc, urlsplit(private_base_url).netloc}
+    requests_before = sum(get_limiter(host).limits()["requests"] for host in hosts)
+
+    # Unique usernames so logins are not coalesced across levels
+    usernames = ["load{}x{}".format(concurrency, i) for i in range(accounts)]
+    account_latencies, operation_latencies, errors = [], {}, 0
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(
+            _harvest_account, username, password, base_url, private_base_url, methods, scraper_class)
+            for username in usernames]
+        for future in futures:
+            try:
+                total, timings = future.result()
+            except Exception:
+                errors += 1
+                continue
+            account_latencies.append(total)
+            for name, value in timings.items():
+                operation_latencies.setdefault(name, []).append(value)
+    duration = time.monotonic() - start
+
+    requests_sent = sum(get_limiter(host).limits()["requests"] for host in hosts) - requests_before
+    latency = {"account": account_latencies}
+    latency.update(operation_latencies)
+
+    return {
+        "concurrency": concurrency,
+        "accounts": accounts,
+        "errors": errors,
+        "duration": duration,
+        "requests": requests_sent,
+        "requests_per_second": requests_sent / duration if duration else 0,
+        "accounts_per_second": len(account_latencies) / duration if duration else 0,
+        "latency": {
+            name: {"p50": percentile(values, 50), "p90": percentile(values, 90), "p99": percentile(values, 99)}
+            for name, values in latency.items()
+        },
+    }
+
+
+def run_load(base_url, private_base_url=None, levels=(1, 2, 4, 8, 16), accounts_per_worker=4, lift_limits=False, **kwargs):
+    '''
+    Run run_level at rising concurrency levels and return the list of measurements.
+
+    Args:
+        base_url (str): Base URL of the eGovernance website.
+        private_base_url (str, optional): Base URL of the APP API. Defaults to base_url.
+        levels (iterable): Concurrency levels to run.
+        accounts_per_worker (int): Accounts harvested per concurrent worker at each level.
+        lift_limits (bool): Lift the rate limits of the hosts to measure the server itself. Only do this
+            for a mock server, never for the university servers.
+        **kwargs: Passed on to run_level.
+    '''
+    private_base_url = private_base_url or base_url
+    if lift_limits:
+        for host in {urlsplit(base_url).netloc, urlsplit(private_base_url).netloc}:
+            configure_host(host, rate=1e9, burst=1e9, initial_concurrency=max(levels) * 4, max_concurrency=max(levels) * 4, target_latency=1e9)
+
+    return [run_level(level, level * accounts_per_worker, base_url, private_base_url, **kwargs) for level in levels]
+
+
+def format_report(results):
+    '''
+    Format run_load measurements as a text table with latencies in milliseconds.
+    '''
+    lines = ["{:>11} {:>8} {:>6} {:>9} {:>10} {:>9} {:>9} {:>9}".format(
+        "concurrency", "accounts", "errors", "req/s", "accounts/s", "p50 ms", "p90 ms", "p99 ms")]
+    for result in results:
+        account = result["latency"]["account"]
+        lines.append("{:>11} {:>8} {:>6} {:>9.1f} {:>10.2f} {:>9} {:>9} {:>9}".format(
+            result["concurrency"], result["accounts"], result["errors"], result["requests_per_second"],
+            result["accounts_per_second"],
+            *["-" if account[p] is None else "{:.0f}".format(account[p] * 1000) for p in ("p50", "p90", "p99")]))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load generator for CharusatScraper")
+    parser.add_argument("--url", help="Base URL of a running server. Starts a local mock server when omitted.")
+    parser.add_argument("--private-url", help="Base URL of the APP API. Defaults to --url.")
+    parser.add_argument("--levels", default="1,2,4,8,16", help="Comma separated concurrency levels")
+    parser.add_argument("--accounts-per-worker", type=int, default=4)
+    parser.add_argument("--methods", default=",".join(DEFAULT_METHODS))
+    parser.add_argument("--unlimited", action="store_true",
+                        help="Lift the rate limits for --url too. They are always lifted for the local mock server.")
+    parser.add_argument("--latency", type=float, default=0.02, help="Mock server latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Mock server jitter in seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Mock server failure rate")
+    args = parser.parse_args()
+
+    server = None
+    base_url = args.url
+    if base_url is None:
+        server = MockEGovServer(MockConfig(latency=args.latency, jitter=args.jitter, failure_rate=args.failure_rate)).start()
+        base_url = server.url
+
+    try:
+        results = run_load(
+            base_url, args.private_url,
+            levels=[int(level) for level in args.levels.split(",")],
+            accounts_per_worker=args.accounts_per_worker,
+            lift_limits=server is not None or args.unlimited,
+            methods=args.methods.split(","))
+        print(format_report(results))
+    finally:
+        if server is not None:
+            server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,401 @@
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+SUBJECTS = [
+    ("CE391 / PDA", "PYTHON FOR DATA ANALYTICS"),
+    ("EE342 / SDCM", "SYNCHRONOUS AND DC MACHINES"),
+    ("EE351 / EPTD", "ELECTRICAL POWER TRANSMISSION AND DISTRIBUTION"),
+    ("EE353 / PED-I", "POWER ELECTRONICS AND DRIVES - I"),
+    ("EE375 / ECAM", "ENERGY CONSERVATION, AUDIT AND MANAGEMENT"),
+]
+
+SLOTS = ["09:10 - 10:09", "10:10 - 11:09", "12:10 - 14:09", "14:20 - 16:20", "16:20 - 18:19"]
+
+MONTHS = ["JANUARY", "FEBRUARY", "MARCH", "APRIL", "MAY", "JUNE", "JULY", "AUGUST", "SEPTEMBER", "OCTOBER", "NOVEMBER", "DECEMBER"]
+
+
+class MockConfig:
+    '''
+    Behaviour of the mock server.
+    '''
+
+    def __init__(self, latency=0.0, jitter=0.0, login_latency=None, failure_rate=0.0, password="password", semesters=5):
+        '''
+        Args:
+            latency (float): Seconds every response is delayed by.
+            jitter (float): Maximum extra random delay in seconds.
+            login_latency (float, optional): Delay of the login endpoints instead of latency.
+            failure_rate (float): Fraction of requests answered with HTTP 500.
+            password (str): Password accepted for every username.
+            semesters (int): Number of semesters with results and fees per account.
+        '''
+        self.latency = latency
+        self.jitter = jitter
+        self.login_latency = login_latency
+        self.failure_rate = failure_rate
+        self.password = password
+        self.semesters = semesters
+
+
+def _seed(username):
+    return int(hashlib.sha256(username.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def _hidden_inputs(viewstate):
+    return (
+        '<input type="hidden" name="__VIEWSTATE" id="__VIEWSTATE" value="{}" />'
+        '<input type="hidden" name="__VIEWSTATEGENERATOR" id="__VIEWSTATEGENERATOR" value="5D8E3A7B" />'
+        '<input type="hidden" name="__EVENTVALIDATION" id="__EVENTVALIDATION" value="{}" />'
+    ).format(viewstate, viewstate[::-1])
+
+
+def _delta(panel, html, viewstate):
+    '''
+    Build an ASP.NET AJAX delta response for an UpdatePanel postback.
+    '''
+    return "{}|updatePanel|{}|{}|{}|hiddenField|__VIEWSTATE|{}|{}|hiddenField|__EVENTVALIDATION|{}|".format(
+        len(html), panel, html, len(viewstate), viewstate, len(viewstate), viewstate[::-1])
+
+
+def attendance_html(username):
+    rng = random.Random(_seed(username))
+    rows, names = [], []
+    for code, name in SUBJECTS:
+        names.append("<tr><td>{}</td><td>{}</td></tr>".format(code, name))
+        for class_type in ("LECT", "LAB"):
+            total = rng.randint(10, 60)
+            present = rng.randint(total // 2, total)
+            rows.append(
+                "<tr><td><span>{}</span></td><td><span>{}</span></td><td>\r\n {} / {} \r\n</td><td>{}%</td></tr>".format(
+                    code, class_type, present, total, present * 100 // total))
+    return (
+        '<span id="lblHeadAnnouncement">Gross Attendance of Semester 5 - 77.40 %</span>'
+        '<table id="gvGrossAttPop"><tr><th>Course</th><th>Type</th><th>Attendance</th><th>%</th></tr>{}</table>'
+        '<table id="gvGAttSubjectsPop"><tr><th>Code</th><th>Name</th></tr>{}</table>'
+    ).format("".join(rows), "".join(names))
+
+
+def attendance_status_html(username):
+    rows = "".join(
+        "<tr><td>{}</td><td>FACULTY NAME</td><td>{}</td><td>P</td></tr>".format(slot, code)
+        for slot, (code, _) in zip(SLOTS, SUBJECTS))
+    names = "".join("<tr><td>{}</td><td>{}</td></tr>".format(code, name) for code, name in SUBJECTS)
+    return (
+        '<table id="gvtimetableDetails"><tr><th>Time</th><th>Faculty</th><th>Course</th><th>Status</th></tr>{}</table>'
+        '<table id="gvfullform"><tr><th>Code</th><th>Name</th></tr>{}</table>'
+    ).format(rows, names)
+
+
+def fees_html(username, semesters):
+    rows = "".join(
+        "<tr><td>{}</td><td>60000.00</td><td>60000.00</td><td>0.00</td><td>0.00</td></tr>".format(sem)
+        for sem in range(semesters, 0, -1))
+    return '<table id="gvfees_details"><tr><th>Sem</th><th>Total</th><th>Recieved</th><th>Scholarship</th><th>Pending</th></tr>{}</table>'.format(rows)
+
+
+def result_html(username):
+    rows = "".join(
+        "<tr><td>{}</td><td>THEORY</td><td>4.00</td><td>AA</td></tr>".format(name) for _, name in SUBJECTS)
+    return (
+        '<span id="lblSem">2</span><span id="lblStudentName">STUDENT {0}</span><span id="lblStudentID">{0}</span>'
+        '<table id="gvresult"><tr><th>Course</th><th>Type</th><th>Credit</th><th>Grade</th></tr>{1}</table>'
+        '<table id="gvresult1"><tr><th>Month</th><th>Total</th><th>Earned</th><th>SGPA</th></tr>'
+        '<tr><td>APRIL 2023</td><td>20.00</td><td>20.00</td><td>9.45</td></tr></table>'
+    ).format(username.upper(), rows)
+
+
+def enrollment_html(username):
+    fields = [
+        ("txtIDNo", username.upper()), ("txtRegDate", "24/09/2021"), ("txtDateOfAdmission", "24/09/2021"),
+        ("txtDisplayName", "STUDENT " + username.upper()), ("rbtGender", "Male"), ("txtNationality", "INDIAN"),
+        ("txtMotherTongue", "GUJARATI"), ("txtBirthDate", "01/01/2003"), ("txtBirthPlace", "ANAND"),
+        ("reference1$Address1$txtAddress1", "ADDRESS"), ("reference1$Address1$txtCity", "ANAND"),
+        ("reference1$Address1$txtState", "GUJARAT"), ("AD2$txtPincode", "388421"),
+    ]
+    inputs = "".join(
+        '<input name="ctl00$ContentPlaceHolder1${}" type="text" value="{}" />'.format(name, value) for name, value in fields)
+    return (
+        '<html><body><form>{}'
+        '<table id="ctl00_ContentPlaceHolder1_gv_tblEducation">'
+        '<tr><th>Exam</th><th>Seat No.</th><th>CGPA/Percentage Obtained</th><th>Year</th></tr>'
+        '<tr><td>SSC</td><td>000000</td><td>85.4</td><td>2019</td></tr>'
+        '<tr><td>HSC</td><td>000000</td><td>72.6</td><td>2021</td></tr>'
+        '</table></form></body></html>'
+    ).format(inputs)
+
+
+class MockEGovServer:
+    '''
+    Local mock of the eGovernance website and the APP API, for load tests and development.
+
+    Emulates the login page and cookies, the frmAppSelection.aspx delta postbacks with viewstate
+    checks, frmEnrollment.aspx and the eMethod219/683/467/347 JSON calls with generated data.
+    Every username is accepted with the configured password. Latency and failures can be injected.
+
+    Example:
+        server = MockEGovServer(MockConfig(latency=0.05)).start()
+        scraper = CharusatScraper("21CE001", "password", base_url=server.url, private_base_url=server.url)
+        server.stop()
+    '''
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        '''
+        Args:
+            config (MockConfig, optional): Behaviour of the server.
+            host (str): Address to listen on.
+            port (int): Port to listen on, 0 picks a free port.
+        '''
+        self.config = config or MockConfig()
+        self.sessions = {}
+        self.stats = Counter()
+        self._secret = uuid.uuid4().bytes
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self):
+        '''
+        Serve in a background thread and return the server.
+        '''
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def _viewstate_mac(self, session_id, nonce):
+        return hmac.new(self._secret, "{}|{}".format(session_id, nonce).encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+    def new_viewstate(self, session_id):
+        '''
+        Issue a viewstate for a session, signed like ASP.NET's viewstate MAC.
+        '''
+        with self._lock:
+            self.sessions.setdefault(session_id, {"username": None})
+        nonce = uuid.uuid4().hex
+        return "{}{}".format(nonce, self._viewstate_mac(session_id, nonce))
+
+    def valid_viewstate(self, session_id, viewstate):
+        nonce, mac = viewstate[:32], viewstate[32:]
+        return hmac.compare_digest(mac, self._viewstate_mac(session_id, nonce))
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _cookies(self):
+                cookies = {}
+                for part in self.headers.get("Cookie", "").split(";"):
+                    name, _, value = part.strip().partition("=")
+                    if name:
+                        cookies[name] = value
+                return cookies
+
+            def _send(self, status, body, content_type="text/html; charset=utf-8", headers=()):
+                if isinstance(body, str):
+                    body = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_body(self):
+                length = int(self.headers.get("Content-Length", 0))
+                return self.rfile.read(length) if length else b""
+
+            def _delay(self, path):
+                config = server.config
+                latency = config.latency
+                if config.login_latency is not None and (path.endswith("Home.aspx") or path.endswith("eMethod219")):
+                    latency = config.login_latency
+                latency += random.uniform(0, config.jitter) if config.jitter else 0
+                if latency:
+                    time.sleep(latency)
+
+            def _handle(self, method):
+                path = urlsplit(self.path).path
+                body = self._read_body() if method == "POST" else b""
+                with server._lock:
+                    server.stats[path] += 1
+                self._delay(path)
+
+                if random.random() < server.config.failure_rate:
+                    return self._send(500, "<html><body>Server Error in '/' Application.</body></html>")
+
+                if path.startswith("/api/Water/"):
+                    return self._api(path.rsplit("/", 1)[-1], body)
+                if path in ("/eGovernance/", "/eGovernance/Default.aspx"):
+                    return self._login_page()
+                if path == "/eGovernance/Home.aspx" and method == "POST":
+                    return self._login(parse_qs(body.decode("utf-8")))
+
+                session_id = self._cookies().get("ASP.NET_SessionId")
+                session = server.sessions.get(session_id)
+                if session is None or session["username"] is None:
+                    return self._send(302, "", headers=[("Location", "/eGovernance/")])
+
+                if path == "/eGovernance/frmAppSelection.aspx":
+                    if method == "GET":
+                        return self._send(200, "<html><body><form>{}</form></body></html>".format(
+                            _hidden_inputs(server.new_viewstate(session_id))))
+                    return self._postback(session_id, session, parse_qs(body.decode("utf-8")))
+                if path == "/eGovernance/SES/frmEnrollment.aspx":
+                    return self._send(200, enrollment_html(session["username"]))
+
+                self._send(404, "Not Found")
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+            def _login_page(self):
+                session_id = self._cookies().get("ASP.NET_SessionId") or uuid.uuid4().hex[:24]
+                self._send(
+                    200, "<html><body><form>{}</form></body></html>".format(_hidden_inputs(server.new_viewstate(session_id))),
+                    headers=[("Set-Cookie", "ASP.NET_SessionId={}; path=/; HttpOnly".format(session_id))])
+
+            def _login(self, form):
+                session_id = self._cookies().get("ASP.NET_SessionId")
+                username = form.get("txtUserName", [""])[0]
+                password = form.get("txtPassword", [""])[0]
+                viewstate = form.get("__VIEWSTATE", [""])[0]
+                session = server.sessions.get(session_id)
+
+                if session is None or not server.valid_viewstate(session_id, viewstate) or password != server.config.password:
+                    return self._send(200, "1|#||4|26|scriptBlock|ScriptPath|alert('Invalid Login');|")
+
+                session["username"] = username
+                self._send(
+                    200, "1|#||4|42|pageRedirect||%2feGovernance%2ffrmAppSelection.aspx|",
+                    content_type="text/plain; charset=utf-8",
+                    headers=[
+                        ("Set-Cookie", "ASP.NET_SessionId={}; path=/; HttpOnly".format(session_id)),
+                        ("Set-Cookie", ".EGovWebApp={}; path=/; HttpOnly".format(uuid.uuid4().hex.upper())),
+                    ])
+
+            def _postback(self, session_id, session, form):
+                viewstate = form.get("__VIEWSTATE", [""])[0]
+                if not server.valid_viewstate(session_id, viewstate):
+                    return self._send(500, "<html><body>Validation of viewstate MAC failed.</body></html>")
+
+                script_manager = form.get("ScriptManager1", [""])[0]
+                panel, _, target = script_manager.partition("|")
+                username = session["username"]
+                new_viewstate = server.new_viewstate(session_id)
+
+                if panel == "UpGrossAtt":
+                    html = attendance_html(username)
+                elif panel == "upTimeTable":
+                    html = attendance_status_html(username)
+                elif panel == "upPendingAtt":
+                    html = fees_html(username, server.config.semesters)
+                elif panel == "updSchedule" and target == "ddlsemester":
+                    html = result_html(username)
+                elif panel == "updSchedule":
+                    html = ""
+                else:
+                    return self._send(500, "<html><body>Unknown postback.</body></html>")
+
+                self._send(200, _delta(panel, html, new_viewstate), content_type="text/plain; charset=utf-8")
+
+            def _api(self, name, body):
+                try:
+                    payload = json.loads(body or b"{}")
+                except ValueError:
+                    return self._send(400, "{}", content_type="application/json; charset=utf-8")
+
+                username = payload.get("EPara2", "")
+                if name == "eMethod219":
+                    if payload.get("EPara3") != server.config.password:
+                        data = {"UserDetails": [{"Message": "Invalid Username or Password", "Status": 0}]}
+                    else:
+                        data = {"UserDetails": [{
+                            "Message": "Success", "Status": 1, "studentsysid": _seed(username) % 100000,
+                            "StudentID": username.upper(), "StudentName": "STUDENT " + username.upper()}]}
+                elif name == "eMethod683":
+                    sem = int(payload.get("EPara3") or 1)
+                    data = {"tblScheduleExam": [] if sem > server.config.semesters else [{
+                        "ScheduleExamID": 1000 + sem, "ExamMonthYear": "{} {}".format(MONTHS[(sem * 5) % 12], 2021 + sem // 2),
+                        "Semester": sem}]}
+                elif name == "eMethod467":
+                    exam_id = int(payload.get("EPara3") or 1001)
+                    sem = exam_id - 1000
+                    data = {
+                        "tblStudentResultDet": [{
+                            "SubjectName": name_, "SubjectCode": code.split(" / ")[0], "Padagoggy": "THEORY",
+                            "Credit": "4.00", "Grade": "AA", "ParentSubjectID": str(7000 + i)} for i, (code, name_) in enumerate(SUBJECTS)],
+                        "tblStudentResultMst": [{
+                            "StudentName": "STUDENT", "StudentID": "", "FacultyName": "FACULTY OF TECHNOLOGY AND ENGINEERING",
+                            "Date": "23/02/2022", "Program": "B.TECH. (ELECTRICAL)",
+                            "ExamMonthYear": "{} {}".format(MONTHS[(sem * 5) % 12], 2021 + sem // 2),
+                            "StudentType": "FRESHER", "totCredit": "20.00", "CreditEarned": "20.00", "sgpa": "9.45",
+                            "cgpa": "9.45", "noofbacklog": "0.00", "StudentLastSem": str(server.config.semesters)}],
+                    }
+                elif name == "eMethod347":
+                    date = payload.get("EPara3", "")
+                    data = {"tblActualTimeTable": [{
+                        "RowID": str(i + 1), "Message": "Success", "Status": 1, "TTDate": date, "TTTime": slot,
+                        "AttTaken": "P", "FacultyName": "FACULTY NAME", "Subjectdet": "0000 / " + code.split(" / ")[1],
+                        "StudentDetails": "BTECH(EE) / SEM 5 / DIV-I", "dayType": "T", "Daymsg": ""}
+                        for i, (slot, (code, _)) in enumerate(zip(SLOTS, SUBJECTS))]}
+                else:
+                    return self._send(404, "{}", content_type="application/json; charset=utf-8")
+
+                self._send(200, json.dumps(data), content_type="application/json; charset=utf-8")
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock CHARUSAT eGovernance server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8912)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--login-latency", type=float, default=None)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockEGovServer(
+        MockConfig(latency=args.latency, jitter=args.jitter, login_latency=args.login_latency, failure_rate=args.failure_rate),
+        host=args.host, port=args.port)
+    print("Mock eGovernance server listening on {}".format(server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from .scraper import CharusatScraper
+from .utils import parse_attendance_html, parse_attendance_status_html, parse_fees_data, parse_user_details
+
+
+# Scraper method name -> (raw fetch method on CharusatScraper, parser run in the process pool)
+PIPELINE_METHODS = {
+    "get_attendance": ("fetch_attendance", parse_attendance_html),
+    "get_attendance_status_web": ("fetch_attendance_status_web", parse_attendance_status_html),
+    "get_fees_details": ("fetch_fees_details", parse_fees_data),
+    "get_user_details": ("fetch_user_details", parse_user_details),
+}
+
+_DONE = object()
+
+
+def harvest(accounts, methods=("get_attendance", "get_fees_details"), fetch_workers=8, parse_workers=None, queue_size=32, scraper_class=CharusatScraper, archive=None):
+    '''
+    Harvest data for many accounts with network fetching and HTML parsing split into two stages.
+
+    Fetch threads only log in and download raw responses. The responses are handed over a bounded
+    queue to a process pool that runs the parsers, so parsing is not limited to a single core by the GIL.
+    When the parsers fall behind, the queue fills up and the fetch threads block until there is room again.
+
+    Args:
+        accounts (iterable): (username, password) pairs to harvest.
+        methods (iterable): Scraper method names to run for each account, keys of PIPELINE_METHODS.
+        fetch_workers (int): Number of network threads.
+        parse_workers (int, optional): Number of parser processes. Defaults to the number of CPUs.
+        queue_size (int): Maximum number of raw responses waiting to be parsed.
+        scraper_class (type): Class used to log in each account.
+        archive (ResponseArchive, optional): Archive recording the raw responses, see archive.reparse.
+
+    Yields:
+        dict: One entry per account and method, in completion order, with the keys
+            - 'username': The account the data belongs to
+            - 'method': The scraper method name
+            - 'data': The parsed data, or None on failure
+            - 'error': The exception raised while fetching or parsing, or None
+
+    Raises:
+        ValueError: If a method is not supported by the pipeline.
+    '''
+    methods = list(methods)
+    for method in methods:
+        if method not in PIPELINE_METHODS:
+            raise ValueError("Method '{}' is not supported by the pipeline".format(method))
+
+    accounts = iter(accounts)
+    accounts_lock = threading.Lock()
+    raw_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                raw_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def next_account():
+        with accounts_lock:
+            return next(accounts, None)
+
+    def fetch_worker():
+        try:
+            while not stop.is_set():
+                account = next_account()
+                if account is None:
+                    break
+                username, password = account
+
+                try:
+                    scraper = scraper_class(username, password)
+                except Exception as e:
+                    for method in methods:
+                        if not put((username, method, None, e)):
+                            return
+                    continue
+                if archive is not None:
+                    scraper.archive = archive
+
+                for method in methods:
+                    try:
+                        raw = getattr(scraper, PIPELINE_METHODS[method][0])()
+                        item = (username, method, raw, None)
+                    except Exception as e:
+                        item = (username, method, None, e)
+                    if not put(item):
+                        return
+        finally:
+            put(_DONE)
+
+    threads = [threading.Thread(target=fetch_worker, daemon=True) for _ in range(fetch_workers)]
+    for thread in threads:
+        thread.start()
+
+    parse_workers = parse_workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=parse_workers)
+    # Keep the pool busy without letting parsed results pile up unread
+    max_in_flight = 2 * parse_workers
+    in_flight = {}
+    running = len(threads)
+
+    def collect(futures):
+        for future in futures:
+            username, method = in_flight.pop(future)
+            error = future.exception()
+            yield {
+                "username": username,
+                "method": method,
+                "data": None if error else future.result(),
+                "error": error
+            }
+
+    try:
+        while running or in_flight:
+            if running and len(in_flight) < max_in_flight:
+                try:
+                    item = raw_queue.get(timeout=0.05 if in_flight else None)
+                except queue.Empty:
+                    item = None
+
+                if item is _DONE:
+                    running -= 1
+                elif item is not None:
+                    username, method, raw, error = item
+                    if error is not None:
+                        yield {"username": username, "method": method, "data": None, "error": error}
+                    else:
+                        future = executor.submit(PIPELINE_METHODS[method][1], raw)
+                        in_flight[future] = (username, method)
+
+                done = [future for future in in_flight if future.done()]
+            else:
+                done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+
+            for result in collect(done):
+                yield result
+    finally:
+        stop.set()
+        for future in in_flight:
+            future.cancel()
+        executor.shutdown(wait=False)
@@ -0,0 +1,174 @@
+import datetime
+import heapq
+import itertools
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+def parse_slot_end(tt_date, tt_time):
+    '''
+    Return the end of a timetable slot as a datetime.
+
+    Args:
+        tt_date (str): The 'TTDate' value, e.g. "21/09/2023".
+        tt_time (str): The 'TTTime' value, e.g. "09:10 - 10:09".
+
+    Returns:
+        datetime.datetime: The end of the slot, or None if the values can't be parsed.
+    '''
+    try:
+        end = tt_time.split("-")[-1].strip()
+        return datetime.datetime.strptime("{} {}".format(tt_date, end), '%d/%m/%Y %H:%M')
+    except (AttributeError, ValueError):
+        return None
+
+
+def plan_refreshes(rows, date, delay=600):
+    '''
+    Return the times at which attendance should be refreshed for a day.
+
+    Attendance can only change after a lecture or lab has ended, so there is one refresh
+    shortly after the end of each slot of the day.
+
+    Args:
+        rows (list): The tblActualTimeTable entries returned by get_attendance_status.
+        date (datetime.date): The day being planned, entries of other days are ignored.
+        delay (float): Seconds to wait after a slot ends before refreshing.
+
+    Returns:
+        list: Sorted datetimes, empty on holidays and days without slots.
+    '''
+    date_text = date.strftime('%d/%m/%Y')
+    ends = set()
+    for row in rows or []:
+        if row.get("TTDate") != date_text:
+            continue
+        end = parse_slot_end(row.get("TTDate"), row.get("TTTime"))
+        if end is not None:
+            ends.add(end + datetime.timedelta(seconds=delay))
+    return sorted(ends)
+
+
+class AttendancePrefetcher:
+    '''
+    Schedules attendance refreshes from each account's timetable instead of polling on a fixed interval.
+
+    Every morning the day's timetable of each account is read and a refresh is queued shortly after
+    each of its slots ends. Days without slots cost only that one timetable read. Only school days are
+    read, by default Monday to Saturday: the APP API answers a Sunday with Saturday's timetable, so
+    Sundays would always look empty. The next school day is always planned, so the first day back after
+    a holiday of any length gets its refreshes.
+
+    Example:
+        scraper = CharusatScraper(username, password)
+        prefetcher = AttendancePrefetcher(
+            timetable=lambda account, date: scraper.get_attendance_status(date.strftime('%d/%m/%Y')),
+            refresh=lambda account: store.save_attendance(account, scraper.get_attendance()))
+        prefetcher.add_account(username)
+        prefetcher.run()
+    '''
+
+    def __init__(self, timetable, refresh, delay=600, day_start=datetime.time(7, 0), school_days=(0, 1, 2, 3, 4, 5), retry_after=1800):
+        '''
+        Args:
+            timetable (callable): timetable(account, date) returning the tblActualTimeTable entries of a day.
+            refresh (callable): refresh(account) refreshing the attendance data of an account.
+            delay (float): Seconds to wait after a slot ends before refreshing.
+            day_start (datetime.time): Time of day at which the day's timetable is read.
+            school_days (iterable): Days of the week whose timetable is read, 0 is Monday.
+            retry_after (float): Seconds to wait before retrying a failed timetable read.
+        '''
+        self.timetable = timetable
+        self.refresh = refresh
+        self.delay = delay
+        self.day_start = day_start
+        self.school_days = frozenset(school_days)
+        self.retry_after = retry_after
+
+        self._queue = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def _push(self, when, account, kind):
+        with self._lock:
+            heapq.heappush(self._queue, (when, next(self._counter), account, kind))
+        self._wakeup.set()
+
+    def add_account(self, account, now=None):
+        '''
+        Start scheduling an account, its timetable for today is read right away.
+        '''
+        self._push(now or datetime.datetime.now(), account, "plan")
+
+    def scheduled(self):
+        '''
+        Return the queued jobs as (when, account, kind) tuples, where kind is "plan" or "refresh".
+        '''
+        with self._lock:
+            return [(when, account, kind) for when, _, account, kind in sorted(self._queue)]
+
+    def _next_day_start(self, now):
+        date = now.date() + datetime.timedelta(days=1)
+        # Without school days every day is read, rather than never planning again
+        while self.school_days and date.weekday() not in self.school_days:
+            date += datetime.timedelta(days=1)
+        return datetime.datetime.combine(date, self.day_start)
+
+    def _plan(self, account, now):
+        try:
+            rows = self.timetable(account, now.date())
+        except Exception:
+            logger.exception("Reading the timetable of %s failed", account)
+            self._push(now + datetime.timedelta(seconds=self.retry_after), account, "plan")
+            return
+
+        refreshes = plan_refreshes(rows, now.date(), delay=self.delay)
+
+        if refreshes:
+            upcoming = [when for when in refreshes if when > now]
+            if len(upcoming) < len(refreshes):
+                # Slots already over when planning mid-day are covered by a single refresh now
+                upcoming.insert(0, now)
+            for when in upcoming:
+                self._push(when, account, "refresh")
+        self._push(self._next_day_start(now), account, "plan")
+
+    def run_pending(self, now=None):
+        '''
+        Run every job that is due and return the time of the next one, or None if nothing is queued.
+        '''
+        now = now or datetime.datetime.now()
+        while True:
+            with self._lock:
+                if not self._queue:
+                    return None
+                if self._queue[0][0] > now:
+                    return self._queue[0][0]
+                _, _, account, kind = heapq.heappop(self._queue)
+
+            if kind == "plan":
+                self._plan(account, now)
+            else:
+                try:
+                    self.refresh(account)
+                except Exception:
+                    logger.exception("Refreshing the attendance of %s failed", account)
+
+    def run(self, stop=None):
+        '''
+        Run the scheduler until the stop event is set.
+
+        Args:
+            stop (threading.Event, optional): Event that ends the loop when set.
+        '''
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            self._wakeup.clear()
+            next_run = self.run_pending()
+            timeout = None if next_run is None else max(0, (next_run - datetime.datetime.now()).total_seconds())
+            # Wake up at least every minute to notice the stop event, and early when accounts are added
+            self._wakeup.wait(60 if timeout is None else min(timeout, 60))
@@ -1,6 +1,89 @@
-import requests
 import json
 import datetime
+from urllib.parse import urlsplit
+from .ratelimit import LimitedSession
+from .auth import default_coordinator
+from .errors import InvalidCredentialsError, ResultNotFoundError
+from .jsoncodec import Schema, loads
+
+
+# Only the fields returned by get_schedule_exams and get_result_by_exam_id are decoded from their replies
+SCHEDULE_EXAM_SCHEMA = Schema({
+    "tblScheduleExam": {
+        "ScheduleExamID": "ScheduleExamID",
+        "ExamMonthYear": "ExamMonthYear",
+    }
+})
+
+RESULT_SCHEMA = Schema({
+    "tblStudentResultDet": {
+        "SubjectName": "courseName",
+        "SubjectCode": "courseCode",
+        "Padagoggy": "padagoggy",
+        "Credit": "credit",
+        "Grade": "grade",
+        "ParentSubjectID": "parentSubjectID",
+    },
+    "tblStudentResultMst": {
+        "StudentName": "studentName",
+        "StudentID": "studentID",
+        "FacultyName": "facultyName",
+        "Date": "date",
+        "Program": "program",
+        "ExamMonthYear": "examMonthYear",
+        "StudentType": "studentType",
+        "totCredit": "totalCredits",
+        "CreditEarned": "creditEarned",
+        "sgpa": "sgpa",
+        "cgpa": "cgpa",
+        "noofbacklog": "noofbacklog",
+        "StudentLastSem": "studentLastSem",
+    },
+})
+
+
+def parse_attendance_status(content):
+    '''
+    Decode an eMethod347 reply into its tblActualTimeTable entries.
+
+    Raises:
+        Exception: If there's an error decoding the JSON response.
+    '''
+    try:
+        return loads(content)['tblActualTimeTable']
+    except json.JSONDecodeError:
+        raise Exception("Error Decoding JSON Response")
+
+
+def parse_schedule_exams(content):
+    '''
+    Decode an eMethod683 reply into its tblScheduleExam entries.
+
+    Raises:
+        Exception: If there's an error decoding the JSON response.
+    '''
+    try:
+        return SCHEDULE_EXAM_SCHEMA.decode(content)['tblScheduleExam']
+    except json.JSONDecodeError:
+        raise Exception("Error Decoding JSON Response")
+
+
+def parse_result(content):
+    '''
+    Decode an eMethod467 reply into the result data with 'result' and 'summary' entries.
+
+    Raises:
+        Exception: If there's an error decoding the JSON response.
+    '''
+    try:
+        response = RESULT_SCHEMA.decode(content)
+    except json.JSONDecodeError:
+        raise Exception("Error Decoding JSON Response")
+
+    return {
+        'result': response['tblStudentResultDet'],
+        'summary': [response['tblStudentResultMst'][0]]}
+
 
 class CharusatPrivateAPI:
     '''
@@ -8,14 +91,17 @@ class CharusatPrivateAPI:
     Only Lecture Gross Attendance is not shown in APP rest everything works fine with the APP
     '''
 
-    def __init__(self, username, password):
+    def __init__(self, username, password, coordinator=None, base_url=None, archive=None):
         '''
         Initialize the CharusatPrivateAPI instance with the provided username and password.
 
         Args:
             username (str): The username for authentication.
-            password (str): The password for authentication.'''
-        self.BASE_URL = "http://117.239.83.200:911"
+            password (str): The password for authentication.
+            coordinator (LoginCoordinator, optional): Coordinates logins across instances. Defaults to the shared coordinator.
+            base_url (str, optional): Base URL of the APP API, e.g. of a mock server. Defaults to the university's server.
+            archive (ResponseArchive, optional): Archive recording the raw replies of the fetch_* methods.'''
+        self.BASE_URL = base_url or "http://117.239.83.200:911"
         self.HEADERS = {
             "Content-Type": "application/json; charset=utf-8",
             "User-Agent": "okhttp/4.5.0"
@@ -24,12 +110,38 @@ class CharusatPrivateAPI:
         self.E_PARA1 = "cCavZvyIrpoUEvBaP896+Q=="
         self.username = username
         self.password = password
-        self.session = requests.Session()
+        self.coordinator = coordinator or default_coordinator
+        self.archive = archive
+        self.session = LimitedSession()
         self.session.headers.update(self.HEADERS)
         self.setup_studentsysid()
 
     def setup_studentsysid(self):
-        self.studentsysid = self.get_student_info().get("studentsysid", None)
+        '''
+        Log in through the LoginCoordinator and store the studentsysid used by every other request.
+
+        Concurrent instances for the same account share a single eMethod219 request.
+
+        Raises:
+            InvalidCredentialsError: If the login is rejected or was rejected recently.
+        '''
+        self.studentsysid = self.coordinator.login(
+            "app", self.username, self.password, self._login, host=urlsplit(self.BASE_URL).netloc)
+
+    def _login(self):
+        student_info = self.get_student_info()
+        if student_info is None:
+            raise InvalidCredentialsError(
+                "Check Login Details. The APP API did not accept the credentials.")
+        return student_info.get("studentsysid", None)
+
+    def archive_response(self, endpoint, content):
+        '''
+        Append a raw reply to the archive, if one is set. Returns the content unchanged.
+        '''
+        if self.archive is not None:
+            self.archive.append(self.username, endpoint, content)
+        return content
 
     def get_student_info(self):
         '''
@@ -39,6 +151,7 @@ class CharusatPrivateAPI:
             dict: A dictionary containing student information.
 
         Raises:
+            requests.HTTPError: If the server answers with an error status.
             Exception: If there's an error decoding the JSON response.
 
         '''
@@ -51,14 +164,51 @@ class CharusatPrivateAPI:
 
         response = self.session.post(
             "{}/api/Water/eMethod219".format(self.BASE_URL), data=json.dumps(payload))
+        # Server errors must not be taken for rejected credentials
+        response.raise_for_status()
 
         try:
-            response = response.json()
+            response = loads(response.content)
             if response['UserDetails'][0]['Message'] == "Success":
                 return response['UserDetails'][0]
         except:
             raise Exception("Error decoding JSON Response")
 
+    def fetch_schedule_exams(self, sem=1):
+        '''
+        Fetch the raw eMethod683 reply listing the exams of a semester without decoding it.
+
+        Raises:
+            Exception: If there's an error finding studentsysid.
+        '''
+        studentsysid = self.studentsysid
+
+        if studentsysid is None:
+            raise Exception("Error Finding studentsysid")
+
+        payload = {
+            "EPara1": self.E_PARA1,
+            "EPara2": str(studentsysid),  # studentsysid
+            "EPara3": str(sem),  # sem,
+            "EPara4": "M",
+            "EPara5": self.password
+        }
+
+        response = self.session.post(
+            "{}/api/Water/eMethod683".format(self.BASE_URL), data=json.dumps(payload))
+
+        return self.archive_response("get_schedule_exams", response.content)
+
+    def get_schedule_exams(self, sem=1):
+        '''
+        Get the exams of a semester, latest first, as a list of {'ScheduleExamID', 'ExamMonthYear'} entries.
+        The list is empty if the semester has no results yet.
+
+        Raises:
+            Exception: If there's an error finding studentsysid or decoding the JSON response.
+        '''
+        return parse_schedule_exams(self.fetch_schedule_exams(sem=sem))
+
     def get_schedule_exam_id(self, sem=1, month_year=None):
         """
         Get the schedule exam ID for a specific semester and month_year using the APP API.
@@ -71,6 +221,7 @@ class CharusatPrivateAPI:
             int: The ScheduleExamID for the specified semester or month_year.
 
         Raises:
+            ResultNotFoundError: If there's no result for the semester or month_year.
             Exception: If there's an error finding studentsysid or decoding the JSON response.
         """
 
@@ -84,47 +235,26 @@ class CharusatPrivateAPI:
             month = month_year[0].upper()
             month_year = f"{month} {year}"
 
-        studentsysid = self.studentsysid
-
-        if studentsysid is None:
-            raise Exception("Error Finding studentsysid")
-
-        payload = {
-            "EPara1": self.E_PARA1,
-            "EPara2": str(studentsysid),  # studentsysid
-            "EPara3": str(sem),  # sem,
-            "EPara4": "M",
-            "EPara5": self.password
-        }
-
-        response = self.session.post(
-            "{}/api/Water/eMethod683".format(self.BASE_URL), data=json.dumps(payload))
+        tblScheduleExam = self.get_schedule_exams(sem=sem)
 
         ScheduleExamID = None
 
-        try:
-            response = response.json()
-            tblScheduleExam = response.get('tblScheduleExam', [])
-
-            if not tblScheduleExam:
-                raise Exception("Result not found for sem = {}, month_year = {}".format(sem, month_year))
-
-            if month_year is not None:
-                for exam in tblScheduleExam:
-                    if exam.get('ExamMonthYear') == month_year:
-                        ScheduleExamID = exam.get('ScheduleExamID')
-                        break
-            else:
-                # Defaults to the latest exam
-                ScheduleExamID = tblScheduleExam[0].get("ScheduleExamID")
+        if not tblScheduleExam:
+            raise ResultNotFoundError("Result not found for sem = {}, month_year = {}".format(sem, month_year))
 
-            if ScheduleExamID is None:
-                raise Exception("ScheduleExamID not found in the response.")
+        if month_year is not None:
+            for exam in tblScheduleExam:
+                if exam.get('ExamMonthYear') == month_year:
+                    ScheduleExamID = exam.get('ScheduleExamID')
+                    break
+        else:
+            # Defaults to the latest exam
+            ScheduleExamID = tblScheduleExam[0].get("ScheduleExamID")
 
-            return ScheduleExamID
+        if ScheduleExamID in (None, ""):
+            raise ResultNotFoundError("ScheduleExamID not found in the response.")
 
-        except json.JSONDecodeError:
-            raise Exception("Error Decoding JSON Response")
+        return ScheduleExamID
 
     def get_result_data(self, sem=1, month_year=None):
         '''
@@ -140,65 +270,40 @@ class CharusatPrivateAPI:
         Raises:
             Exception: If there's an error decoding the JSON response.
         '''
-        studentsysid = self.studentsysid
-
         ScheduleExamID = self.get_schedule_exam_id(
             sem=sem, month_year=month_year)
 
+        return self.get_result_by_exam_id(ScheduleExamID)
+
+    def get_result_by_exam_id(self, schedule_exam_id):
+        '''
+        Get the result data of one exam by its ScheduleExamID, as returned by get_schedule_exams.
+
+        Returns:
+            dict: The result data with 'result' and 'summary' entries, as get_result_data.
+
+        Raises:
+            Exception: If there's an error decoding the JSON response.
+        '''
+        return parse_result(self.fetch_result_by_exam_id(schedule_exam_id))
+
+    def fetch_result_by_exam_id(self, schedule_exam_id):
+        '''
+        Fetch the raw eMethod467 reply holding the result of one exam without decoding it.
+        '''
+        studentsysid = self.studentsysid
+
         payload = {
             "EPara1": self.E_PARA1,
             "EPara2": str(studentsysid),  # studentsysid
-            "EPara3": str(ScheduleExamID),  # ScheduleExamID,
+            "EPara3": str(schedule_exam_id),  # ScheduleExamID,
             "EPara4": "M",
             "EPara5": str(self.password)
         }
         response = self.session.post(
             f"{self.BASE_URL}/api/Water/eMethod467", data=json.dumps(payload))
 
-        try:
-            response = response.json()
-
-            result_data = {
-                'result': [],
-                'summary': []}
-
-            for res in response.get('tblStudentResultDet', []):
-                course_data = {
-                    'courseName': res.get("SubjectName", ""),
-                    'courseCode': res.get("SubjectCode", ""),
-                    'padagoggy': res.get("Padagoggy", ""),
-                    'credit': res.get("Credit", ""),
-                    'grade': res.get("Grade", ""),
-                    'parentSubjectID': res.get("ParentSubjectID", "")
-                }
-                result_data['result'].append(course_data)
-
-            tblStudentResultMst = response.get('tblStudentResultMst', [])[0]
-
-            summary_data = {
-                "studentName": tblStudentResultMst.get("StudentName", ""),
-                "studentID": tblStudentResultMst.get("StudentID", ""),
-                "facultyName": tblStudentResultMst.get("FacultyName", ""),
-                "date": tblStudentResultMst.get("Date", ""),
-                "program": tblStudentResultMst.get("Program", ""),
-                "examMonthYear": tblStudentResultMst.get("ExamMonthYear", ""),
-                "studentType": tblStudentResultMst.get("StudentType", ""),
-                "totalCredits": tblStudentResultMst.get("totCredit", ""),
-                "creditEarned": tblStudentResultMst.get("CreditEarned", ""),
-                "creditEarned": tblStudentResultMst.get("CreditEarned", ""),
-                "sgpa": tblStudentResultMst.get("sgpa", ""),
-                "cgpa": tblStudentResultMst.get("cgpa", ""),
-                "noofbacklog": tblStudentResultMst.get("noofbacklog", ""),
-                "studentLastSem": tblStudentResultMst.get("StudentLastSem", ""),
-            }
-
-            result_data['summary'].append(summary_data)
-
-            return result_data
-
-        except json.JSONDecodeError:
-            raise Exception(
-                "Error Decoding JSON Response")
+        return self.archive_response("get_result_by_exam_id", response.content)
 
     def get_attendance_status(self, date=None):
         '''
@@ -215,7 +320,15 @@ class CharusatPrivateAPI:
         Raises:
             Exception: If there's an error decoding the JSON response.
         '''
+        return parse_attendance_status(self.fetch_attendance_status(date=date))
 
+    def fetch_attendance_status(self, date=None):
+        '''
+        Fetch the raw eMethod347 reply for a date without decoding it, see get_attendance_status.
+
+        Raises:
+            ValueError: If the date is not in 'dd/mm/yyyy' format.
+        '''
         studentsysid = self.studentsysid
 
         if date is None:
@@ -242,13 +355,4 @@ class CharusatPrivateAPI:
         response = self.session.post(
             f"{self.BASE_URL}/api/Water/eMethod347", data=json.dumps(payload))
 
-        try:
-            response = response.json()
-
-            attendance_status_data = response['tblActualTimeTable']
-
-            return attendance_status_data
-
-        except json.JSONDecodeError:
-            raise Exception(
-                "Error Decoding JSON Response")
+        return self.archive_response("get_attendance_status", response.content)
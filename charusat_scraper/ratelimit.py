@@ -0,0 +1,188 @@
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+
+
+class HostLimiter:
+    '''
+    Rate and concurrency limiter for a single host.
+
+    Requests first take a token from a token bucket, which caps the sustained request rate,
+    and then wait for one of the concurrency slots. The number of slots adapts AIMD-style:
+    it grows by one slot per window of fast, successful requests and is halved when a request
+    fails or takes longer than the target latency.
+    '''
+
+    def __init__(self, rate=5.0, burst=10, initial_concurrency=2, min_concurrency=1, max_concurrency=8, target_latency=3.0, backoff=0.5):
+        '''
+        Args:
+            rate (float): Sustained requests per second allowed to the host.
+            burst (int): Maximum number of tokens the bucket can hold.
+            initial_concurrency (int): Concurrent requests allowed before any feedback.
+            min_concurrency (int): Lower bound for the adaptive concurrency.
+            max_concurrency (int): Upper bound for the adaptive concurrency.
+            target_latency (float): Latency in seconds above which the host is considered overloaded.
+            backoff (float): Factor the concurrency is multiplied with on errors or slow responses.
+        '''
+        self.rate = float(rate)
+        self.burst = burst
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.target_latency = target_latency
+        self.backoff = backoff
+
+        self.concurrency = float(min(max(initial_concurrency, min_concurrency), max_concurrency))
+        self.tokens = float(burst)
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.avg_latency = None
+
+        self._updated = time.monotonic()
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        '''
+        Block until a token and a concurrency slot are available, then take both.
+        '''
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if self.in_flight < int(self.concurrency) and self.tokens >= 1:
+                    self.tokens -= 1
+                    self.in_flight += 1
+                    return
+                if self.in_flight >= int(self.concurrency):
+                    self._cond.wait()
+                else:
+                    self._cond.wait((1 - self.tokens) / self.rate)
+
+    def release(self, latency, error=False):
+        '''
+        Give back a concurrency slot and adapt the limits to the observed outcome.
+
+        Args:
+            latency (float): How long the request took in seconds.
+            error (bool): Whether the request failed or was throttled by the server.
+        '''
+        with self._cond:
+            self.in_flight -= 1
+            self.requests += 1
+            if self.avg_latency is None:
+                self.avg_latency = latency
+            else:
+                self.avg_latency = 0.8 * self.avg_latency + 0.2 * latency
+
+            if error or latency > self.target_latency:
+                if error:
+                    self.errors += 1
+                now = time.monotonic()
+                # Decrease at most once per latency window, one overload shows up in many requests
+                if now - self._last_decrease > self.target_latency:
+                    self.concurrency = max(self.min_concurrency, self.concurrency * self.backoff)
+                    self._last_decrease = now
+            else:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+
+            self._cond.notify_all()
+
+    def limits(self):
+        '''
+        Return the current limits and counters of the host.
+
+        Returns:
+            dict: A dictionary with the keys 'rate', 'burst', 'tokens', 'concurrency',
+                'in_flight', 'requests', 'errors' and 'avg_latency'.
+        '''
+        with self._cond:
+            self._refill(time.monotonic())
+            return {
+                "rate": self.rate,
+                "burst": self.burst,
+                "tokens": round(self.tokens, 2),
+                "concurrency": int(self.concurrency),
+                "in_flight": self.in_flight,
+                "requests": self.requests,
+                "errors": self.errors,
+                "avg_latency": self.avg_latency,
+            }
+
+
+_limiters = {}
+_host_settings = {}
+_lock = threading.Lock()
+
+
+def configure_host(host, **settings):
+    '''
+    Set the HostLimiter arguments used for a host, e.g. configure_host("charusat.edu.in:912", rate=2).
+
+    Replaces the limiter of the host if one was already created.
+    '''
+    with _lock:
+        _host_settings[host] = settings
+        _limiters[host] = HostLimiter(**settings)
+
+
+def get_limiter(host):
+    '''
+    Return the shared HostLimiter for a host ("hostname:port"), creating it on first use.
+    '''
+    with _lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = _limiters[host] = HostLimiter(**_host_settings.get(host, {}))
+        return limiter
+
+
+def current_limits():
+    '''
+    Return the current limits of every host that has been contacted, keyed by host.
+    '''
+    with _lock:
+        limiters = dict(_limiters)
+    return {host: limiter.limits() for host, limiter in limiters.items()}
+
+
+class LimitedSession(requests.Session):
+    '''
+    requests.Session that sends every request through the limiter of its host.
+
+    Responses with status 429 or 5xx and connection errors count as errors for the limiter.
+    Redirects are followed one hop at a time, so every hop is limited and counted on its own host.
+    '''
+
+    def send(self, request, **kwargs):
+        allow_redirects = kwargs.pop("allow_redirects", True)
+        kwargs.setdefault("stream", self.stream)
+        kwargs.setdefault("verify", self.verify)
+        kwargs.setdefault("cert", self.cert)
+
+        limiter = get_limiter(urlsplit(request.url).netloc)
+        limiter.acquire()
+        start = time.monotonic()
+        error = True
+        try:
+            response = super().send(request, allow_redirects=False, **kwargs)
+            error = response.status_code == 429 or response.status_code >= 500
+        finally:
+            limiter.release(time.monotonic() - start, error)
+
+        if not allow_redirects:
+            return response
+
+        # resolve_redirects sends each hop through this method with allow_redirects=False,
+        # after the slot of the previous hop has been released
+        history = list(self.resolve_redirects(response, request, **kwargs))
+        if history:
+            history.insert(0, response)
+            response = history.pop()
+            response.history = history
+        return response
@@ -0,0 +1,113 @@
+import datetime
+import hashlib
+import json
+from .private_api import CharusatPrivateAPI
+from .jsoncodec import loads
+
+
+def exam_fingerprint(exam):
+    '''
+    Return a fingerprint of a tblScheduleExam entry. Any change of the entry, e.g. a re-evaluation
+    being published, changes the fingerprint.
+    '''
+    return hashlib.sha256(json.dumps(exam, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _has_backlog(noofbacklog):
+    try:
+        return float(noofbacklog) > 0
+    except (TypeError, ValueError):
+        return False
+
+
+def _older_than(timestamp, seconds):
+    return datetime.datetime.fromisoformat(timestamp) <= datetime.datetime.now() - datetime.timedelta(seconds=seconds)
+
+
+def sync_results(store, username, password, semesters=None, client=None, max_semesters=12, backlog_refresh=86400, discovery_refresh=86400, coordinator=None, base_url=None):
+    '''
+    Fetch only the results that are new or changed since the last sync and save them into a HarvestStore.
+
+    The ScheduleExamIDs already fetched for an account are kept as watermarks in the store, with a
+    fingerprint of their schedule entry. The schedule lists (eMethod683) are checked for new or changed
+    exams and the result details (eMethod467) are only fetched for those. Results with backlogs are
+    fetched again at most every backlog_refresh seconds, as remedial exams and re-evaluations change them.
+
+    Without semesters, the first sync of an account discovers its semesters: it stops at the first
+    semester without exams after one with exams, so lateral entry students starting in semester 3
+    are found as well.
+    Later syncs only check the latest known semester, the one after it and the semesters with backlogs,
+    so a steady state sync costs a login and two or three schedule requests. Pass semesters to check
+    others, e.g. range(1, 9) for a full re-check.
+    While an account has no results at all, later syncs only check semester 1, and all semesters are
+    discovered again at most every discovery_refresh seconds.
+
+    Args:
+        store (HarvestStore): The store holding the results and watermarks.
+        username (str): The username.
+        password (str): The password.
+        semesters (iterable, optional): Semesters whose schedule lists are checked.
+        client (CharusatPrivateAPI, optional): A logged in client for the account. Created when omitted.
+        max_semesters (int): Highest semester checked while discovering.
+        backlog_refresh (float): Seconds after which a result with backlogs is fetched again.
+        discovery_refresh (float): Seconds after which an account without results is checked in all semesters again.
+        coordinator (LoginCoordinator, optional): Passed to CharusatPrivateAPI when creating the client.
+        base_url (str, optional): Passed to CharusatPrivateAPI when creating the client.
+
+    Returns:
+        dict: 'semesters' checked and the ScheduleExamIDs whose results were 'fetched'.
+
+    Raises:
+        InvalidCredentialsError: If the login is rejected.
+        Exception: If a reply can't be decoded.
+    '''
+    client = client or CharusatPrivateAPI(username, password, coordinator=coordinator, base_url=base_url)
+    watermarks = {row["schedule_exam_id"]: row for row in store.result_watermarks(username)}
+
+    discover = recheck = False
+    if semesters is None:
+        if watermarks:
+            latest = max(row["semester"] for row in watermarks.values())
+            semesters = {latest, latest + 1}
+            semesters.update(row["semester"] for row in watermarks.values() if _has_backlog(row["noofbacklog"]))
+            semesters = sorted(semesters)
+        else:
+            discover = True
+            semesters = range(1, max_semesters + 1)
+            discovered_at = store.result_discovered_at(username)
+            # A recent discovery found nothing, so only semester 1 is checked until it's due again
+            recheck = discovered_at is not None and not _older_than(discovered_at, discovery_refresh)
+
+    checked, fetched = [], []
+    seen_exams = False
+    for sem in semesters:
+        exams = loads(client.fetch_schedule_exams(sem=sem)).get("tblScheduleExam") or []
+        checked.append(sem)
+        if not exams and discover and (seen_exams or recheck):
+            break
+        seen_exams = seen_exams or bool(exams)
+
+        for exam in exams:
+            schedule_exam_id = exam.get("ScheduleExamID")
+            if schedule_exam_id in (None, ""):
+                continue
+            fingerprint = exam_fingerprint(exam)
+            watermark = watermarks.get(str(schedule_exam_id))
+
+            if watermark is not None and watermark["fingerprint"] == fingerprint and not (
+                    _has_backlog(watermark["noofbacklog"]) and _older_than(watermark["fetched_at"], backlog_refresh)):
+                continue
+
+            result = client.get_result_by_exam_id(schedule_exam_id)
+            summary = result.get("summary") or [{}]
+            with store.transaction():
+                store.save_result(username, result)
+                store.save_result_watermark(
+                    username, schedule_exam_id, sem, exam.get("ExamMonthYear"), fingerprint,
+                    summary[0].get("noofbacklog"))
+            fetched.append(schedule_exam_id)
+
+    if discover and not recheck:
+        store.save_result_discovery(username)
+
+    return {"semesters": checked, "fetched": fetched}
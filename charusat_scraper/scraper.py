@@ -1,9 +1,22 @@
-import requests
 import json
-from urllib.parse import urlencode
-from .errors import MissingCredentialsError
-from .utils import parse_attendance_html, extract_payload_values, parse_attendance_status_html, parse_fees_data, parse_result_data, extract_payload_values_for_results, parse_previous_exam_details, parse_user_info
+import threading
+from requests.cookies import RequestsCookieJar
+from urllib.parse import urlencode, urlsplit
+from .errors import MissingCredentialsError, InvalidCredentialsError, SessionExpiredError
+from .utils import parse_attendance_html, extract_payload_values, parse_attendance_status_html, parse_fees_data, parse_result_data, extract_payload_values_for_results, parse_user_details
 from .private_api import CharusatPrivateAPI
+from .ratelimit import LimitedSession
+from .auth import default_coordinator
+
+
+class _LockedCookieJar(RequestsCookieJar):
+    '''
+    Cookie jar that can be iterated while other threads store cookies in it.
+    '''
+
+    def __iter__(self):
+        with self._cookies_lock:
+            return iter(list(super().__iter__()))
 
 
 class CharusatScraper:
@@ -17,22 +30,110 @@ class CharusatScraper:
         setup: Initialize headers and session for making requests.
         setup_login_cookie_values: Extract and set login cookies.
         check_credentials: Check if username and password are provided.
+        login: Log in once per account, coalescing concurrent logins.
         get_user_details: Retrieve and return user details.
         get_attendance: Retrieve and return attendance data.
         get_timetable: Retrieve and return the student's timetable.
         get_fees_details: Retrieve and return fee details.
         get_result_data: Retrieve and return result data. (pending...)
+
+    Thread safety:
+        By default an instance must only be used from one thread at a time. With thread_safe=True
+        one logged in instance can serve concurrent calls, e.g. from a thread pool: every thread gets
+        its own requests session, while the cookies and the connection pools are shared. The viewstate
+        of each postback is fetched and used within a single call, so concurrent calls don't mix them up.
+        The APP API client is shared as well, its requests don't depend on any session state.
     '''
 
-    def __init__(self, username, password):
-        self.BASE_URL = "https://charusat.edu.in:912"
+    def __init__(self, username, password, coordinator=None, base_url=None, private_base_url=None, thread_safe=False, archive=None):
+        self.BASE_URL = base_url or "https://charusat.edu.in:912"
+        # None keeps the APP API's own default
+        self.PRIVATE_BASE_URL = private_base_url
         self.username = username
         self.password = password
+        self.coordinator = coordinator or default_coordinator
+        self.thread_safe = thread_safe
+        # Optional ResponseArchive recording the raw responses of the fetch_* methods
+        self.archive = archive
+        self._local = threading.local() if thread_safe else None
+        self._login_lock = threading.Lock()
+        self._private_api = None
         self.check_credentials()
-        self.session = requests.Session()
+        session = LimitedSession()
+        if thread_safe:
+            session.cookies = _LockedCookieJar()
+        self.session = session
+        self.login()
+        self.privateAPI = CharusatPrivateAPI
+
+    @property
+    def session(self):
+        '''
+        The requests session to use. In thread safe mode each thread gets its own session sharing
+        the headers, cookies and connection pools of the instance.
+        '''
+        if self._local is None:
+            return self._session
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = LimitedSession()
+            session.headers = self._session.headers
+            session.cookies = self._session.cookies
+            session.adapters = self._session.adapters
+            self._local.session = session
+        return session
+
+    @session.setter
+    def session(self, session):
+        self._session = session
+        if self._local is not None:
+            self._local = threading.local()
+
+    def login(self):
+        '''
+        Log in and set up the session.
+
+        The login goes through the LoginCoordinator: if another instance is already logging in the
+        same account, this waits for it and reuses its session cookies instead of logging in again.
+        Invalid credentials fail immediately for the coordinator's cooldown period.
+
+        Raises:
+            InvalidCredentialsError: If the login is rejected or was rejected recently.
+            requests.HTTPError: If the server answers with an error status. This is not remembered as a failed login.
+        '''
+        with self._login_lock:
+            state = self.coordinator.login(
+                "web", self.username, self.password, self._login, host=urlsplit(self.BASE_URL).netloc)
+
+            self.HEADERS = state["headers"]
+            self.session.headers.update(self.HEADERS)
+            self.session.cookies.update(state["cookies"])
+            self.login_payload_values = state["login_payload_values"]
+            self.EGOV_WEB_APP_COOKIE = state["cookies"].get(".EGovWebApp")
+            self.ASP_NET_SESSIONID_COOKIE = state["cookies"].get("ASP.NET_SessionId")
+
+    @property
+    def private_api(self):
+        '''
+        The APP API client of the account. It logs in with eMethod219 on first use and is reused by
+        later calls, so the APP API login happens once per scraper.
+        '''
+        with self._login_lock:
+            if self._private_api is None:
+                self._private_api = self.privateAPI(
+                    self.username, self.password, coordinator=self.coordinator, base_url=self.PRIVATE_BASE_URL)
+            # Follows the scraper's archive, which may be set after the client was created
+            self._private_api.archive = self.archive
+            return self._private_api
+
+    def _login(self):
         self.setup()
         self.setup_login_cookie_values()
-        self.privateAPI = CharusatPrivateAPI
+        return {
+            "headers": dict(self.HEADERS),
+            "cookies": self.session.cookies.copy(),
+            "login_payload_values": self.login_payload_values
+        }
 
     def check_credentials(self):
         '''
@@ -59,13 +160,13 @@ class CharusatScraper:
         '''
         self.login_payload_values = self.get_payload_values("/eGovernance/")
         self.HEADERS = {
-            "authority": "charusat.edu.in:912",
+            "authority": urlsplit(self.BASE_URL).netloc,
             "accept": "*/*",
             "accept-language": "en",
             "cache-control": "no-cache",
             "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
-            "origin": "https://charusat.edu.in:912",
-            "referer": "https://charusat.edu.in:912/eGovernance/",
+            "origin": self.BASE_URL,
+            "referer": "{}/eGovernance/".format(self.BASE_URL),
             "sec-ch-ua": '"Google Chrome";v="117", "Not;A=Brand";v="8", "Chromium";v="117"',
             "sec-ch-ua-mobile": "?0",
             "sec-ch-ua-platform": '"Windows"',
@@ -77,9 +178,26 @@ class CharusatScraper:
         }
         self.session.headers.update(self.HEADERS)
 
+    # Paths of the login page, expired sessions are redirected there
+    LOGIN_PATHS = ("/eGovernance/", "/eGovernance/Default.aspx")
+
+    def check_session(self, response):
+        '''
+        Raise SessionExpiredError if a request was redirected to the login page. Returns the response unchanged.
+        '''
+        if response.history and urlsplit(response.url).path in self.LOGIN_PATHS:
+            raise SessionExpiredError("The session expired, log in again.")
+        return response
+
     def get_payload_values(self, path):
-        html_data = self.session.get("{}{}".format(self.BASE_URL, path)).text
+        response = self.session.get("{}{}".format(self.BASE_URL, path))
+        response.raise_for_status()
+        html_data = response.content
         result = extract_payload_values(html_data)
+        if path not in self.LOGIN_PATHS:
+            self.check_session(response)
+            if "__VIEWSTATE" not in result:
+                raise SessionExpiredError("No viewstate on {}, the session may have expired.".format(path))
         return result
 
     def extract_cookies(self):
@@ -121,6 +239,8 @@ class CharusatScraper:
             headers=self.HEADERS,
             data=encoded_data,
         )
+        # A server error or throttled login has no cookies either, but says nothing about the credentials
+        response.raise_for_status()
 
         cookie_dict = {
             cookie.name: cookie.value for cookie in response.cookies
@@ -137,14 +257,28 @@ class CharusatScraper:
             self.EGOV_WEB_APP_COOKIE = cookie_dict[".EGovWebApp"]
             self.ASP_NET_SESSIONID_COOKIE = cookie_dict["ASP.NET_SessionId"]
         else:
-            raise ValueError(
+            raise InvalidCredentialsError(
                 "Check Login Details. Both '.EGovWebApp' and 'ASP.NET_SessionId' cookies are required in the dictionary."
             )
 
+    def archive_response(self, endpoint, content):
+        '''
+        Append a raw response to the archive, if one is set. Returns the content unchanged.
+        '''
+        if self.archive is not None:
+            self.archive.append(self.username, endpoint, content)
+        return content
+
     def get_attendance(self):
         '''
         Retrieve HTML data containing Gross Lecture Attendance information for the authenticated user and return it after parsing the data.
         '''
+        return parse_attendance_html(self.fetch_attendance())
+
+    def fetch_attendance(self):
+        '''
+        Fetch the raw Gross Lecture Attendance response bytes without parsing it.
+        '''
 
         payload_values = self.get_payload_values(
             "/eGovernance/frmAppSelection.aspx")
@@ -166,7 +300,7 @@ class CharusatScraper:
             data=data,
         )
 
-        return parse_attendance_html(response.text)
+        return self.archive_response("get_attendance", response.content)
 
     def get_attendance_status_web(self):
         '''
@@ -175,6 +309,12 @@ class CharusatScraper:
         Note:
             - At present, it is only possible to retrieve lecture attendance data for the most recent day.
         '''
+        return parse_attendance_status_html(self.fetch_attendance_status_web())
+
+    def fetch_attendance_status_web(self):
+        '''
+        Fetch the raw Attendance Status response bytes without parsing it.
+        '''
 
         payload_values = self.get_payload_values(
             "/eGovernance/frmAppSelection.aspx")
@@ -196,18 +336,22 @@ class CharusatScraper:
             data=data,
         )
 
-        return parse_attendance_status_html(response.text)
+        return self.archive_response("get_attendance_status_web", response.content)
 
     def get_attendance_status(self, date=None):
 
-        privateAPI = self.privateAPI(self.username, self.password)
-
-        return privateAPI.get_attendance_status(date=date)
+        return self.private_api.get_attendance_status(date=date)
 
     def get_fees_details(self):
         '''
         Retrieve HTML data containing Fees information for the authenticated user and return it after parsing the data.
         '''
+        return parse_fees_data(self.fetch_fees_details())
+
+    def fetch_fees_details(self):
+        '''
+        Fetch the raw Fees response bytes without parsing it.
+        '''
 
         payload_values = self.get_payload_values(
             "/eGovernance/frmAppSelection.aspx")
@@ -231,7 +375,7 @@ class CharusatScraper:
             data=data,
         )
 
-        return parse_fees_data(response.text)
+        return self.archive_response("get_fees_details", response.content)
 
     def get_results_payload(self):
 
@@ -255,7 +399,7 @@ class CharusatScraper:
             data=data,
         )
 
-        result = extract_payload_values_for_results(response.text)
+        result = extract_payload_values_for_results(response.content)
 
         return result
 
@@ -271,6 +415,12 @@ class CharusatScraper:
 
         These limitations are actively being addressed, and the method will be updated once the issues are resolved.
         '''
+        return parse_result_data(self.fetch_result_data_web(sem=sem))
+
+    def fetch_result_data_web(self, sem=1):
+        '''
+        Fetch the raw result response bytes without parsing it. See get_result_data_web for its limitations.
+        '''
 
         payload_values = self.get_results_payload()
 
@@ -294,9 +444,7 @@ class CharusatScraper:
             data=data,
         )
 
-        # print(response.text)
-
-        return parse_result_data(response.text)
+        return self.archive_response("get_result_data_web", response.content)
 
     def get_result_data(self, sem=1, month_year=None):
         '''
@@ -304,24 +452,20 @@ class CharusatScraper:
 
         The APP API requires a less payload compared to the web login method
         '''
-        privateAPI = self.privateAPI(self.username, self.password)
-
-        return privateAPI.get_result_data(sem=sem, month_year=month_year)
+        return self.private_api.get_result_data(sem=sem, month_year=month_year)
 
     def get_user_details(self):
         '''
         Retrieve HTML data containing User information and Previous Exam Details for the authenticated user and return it after parsing the data.
         '''
-        response = self.session.post(
-            "{}/eGovernance/SES/frmEnrollment.aspx".format(self.BASE_URL))
-
-        user_info = parse_user_info(response.text)
-        previous_exam_details = parse_previous_exam_details(response.text)
+        # return json.dumps(data, indent=4)
+        return parse_user_details(self.fetch_user_details())
 
-        data = {
-            "user_info": user_info,
-            "previous_exam_details": previous_exam_details
-        }
+    def fetch_user_details(self):
+        '''
+        Fetch the raw enrollment page bytes holding User information and Previous Exam Details without parsing it.
+        '''
+        response = self.check_session(self.session.post(
+            "{}/eGovernance/SES/frmEnrollment.aspx".format(self.BASE_URL)))
 
-        # return json.dumps(data, indent=4)
-        return data
+        return self.archive_response("get_user_details", response.content)
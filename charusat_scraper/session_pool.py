@@ -0,0 +1,257 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from .auth import LoginCoordinator
+from .scraper import CharusatScraper
+
+
+logger = logging.getLogger(__name__)
+
+# Rough size of a requests session with its adapters, on top of the cookies and strings it holds
+SESSION_OVERHEAD = 16 * 1024
+
+
+def estimate_session_size(obj):
+    '''
+    Estimate the memory held by a logged in CharusatScraper or CharusatPrivateAPI in bytes.
+
+    Counts the strings, dictionaries and cookies stored on the instance, such as the login
+    viewstate, plus a fixed overhead for the session. This is an estimate used for the pool's
+    memory cap, not an exact measurement.
+    '''
+    size = SESSION_OVERHEAD
+    for value in vars(obj).values():
+        if isinstance(value, (str, bytes)):
+            size += len(value)
+        elif isinstance(value, dict):
+            size += sum(len(str(key)) + len(str(item)) for key, item in value.items())
+    session = vars(obj).get("_session") or vars(obj).get("session")
+    if session is not None:
+        size += sum(len(cookie.name) + len(cookie.value or "") + 64 for cookie in session.cookies)
+        size += sum(len(key) + len(value) for key, value in session.headers.items())
+    return size
+
+
+class _PooledSession:
+    def __init__(self, username, password, obj, size):
+        self.username = username
+        self.password = password
+        self.obj = obj
+        self.size = size
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.leases = 0
+
+
+class SessionPool:
+    '''
+    Pool of logged in sessions for recently active accounts.
+
+    Callers lease the session of an account instead of logging in on every request, so requests
+    for hot accounts only cost the data round trip. Sessions are created on first use, evicted
+    least recently used first when the pool exceeds max_sessions or max_bytes, and sessions of
+    recently used accounts are logged in again in the background before they expire.
+
+    Sessions are created with thread_safe=True by default, so one session can be leased by
+    several callers at the same time. Sessions that are leased are never evicted.
+    '''
+
+    def __init__(self, factory=None, max_sessions=500, max_bytes=64 * 1024 * 1024, ttl=1200, rewarm_before=120, rewarm_interval=30, size_func=estimate_session_size):
+        '''
+        Args:
+            factory (callable, optional): factory(username, password) returning a logged in session.
+                Defaults to CharusatScraper with thread_safe=True.
+            max_sessions (int): Maximum number of sessions kept.
+            max_bytes (int): Maximum estimated memory of all sessions.
+            ttl (float): Seconds a session stays valid after logging in, 20 minutes like the server's session timeout.
+            rewarm_before (float): Seconds before expiry at which a recently used session is logged in again.
+                0 disables the background re-warming.
+            rewarm_interval (float): Seconds between checks for sessions to re-warm.
+            size_func (callable): Returns the estimated size of a session in bytes.
+        '''
+        self.factory = factory or (lambda username, password: CharusatScraper(username, password, thread_safe=True))
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.rewarm_before = rewarm_before
+        self.rewarm_interval = rewarm_interval
+        self.size_func = size_func
+
+        self._entries = OrderedDict()
+        self._creating = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "rewarms": 0}
+
+        self._stop = threading.Event()
+        self._thread = None
+        if rewarm_before > 0:
+            self._thread = threading.Thread(target=self._rewarm_loop, daemon=True)
+            self._thread.start()
+
+    def _expired(self, entry, now):
+        return now - entry.created >= self.ttl
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
+        return entry
+
+    def _evict(self):
+        # Called with the lock held, leased sessions are skipped
+        for key in list(self._entries):
+            if len(self._entries) <= self.max_sessions and self._bytes <= self.max_bytes:
+                return
+            if self._entries[key].leases == 0:
+                self._remove(key)
+                self._stats["evictions"] += 1
+
+    def _store(self, key, username, password, obj, last_used=None):
+        entry = _PooledSession(username, password, obj, self.size_func(obj))
+        with self._lock:
+            old = self._entries.get(key)
+            if old is not None:
+                entry.leases = old.leases
+                self._bytes -= old.size
+            # Replacing an existing key keeps its LRU position
+            self._entries[key] = entry
+            if last_used is None:
+                self._entries.move_to_end(key)
+            else:
+                entry.last_used = last_used
+            self._bytes += entry.size
+            self._evict()
+        return entry
+
+    def acquire(self, username, password):
+        '''
+        Lease the session of an account, logging in if there is no valid one. Pair with release.
+
+        Raises:
+            Exception: Any exception raised by the factory, e.g. InvalidCredentialsError.
+        '''
+        key = LoginCoordinator.account_key(username, password)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                entry = self._entries.get(key)
+                if entry is not None and not self._expired(entry, now):
+                    self._entries.move_to_end(key)
+                    entry.leases += 1
+                    entry.last_used = now
+                    self._stats["hits"] += 1
+                    return entry.obj
+
+                creating = self._creating.get(key)
+                if creating is None:
+                    creating = self._creating[key] = threading.Event()
+                    self._stats["misses"] += 1
+                    break
+
+            # Another caller is logging the account in, wait for it and look again
+            creating.wait()
+
+        try:
+            obj = self.factory(username, password)
+            entry = self._store(key, username, password, obj)
+            with self._lock:
+                entry.leases += 1
+            return obj
+        finally:
+            with self._lock:
+                del self._creating[key]
+            creating.set()
+
+    def release(self, username, password):
+        '''
+        End a lease started with acquire.
+        '''
+        key = LoginCoordinator.account_key(username, password)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.leases > 0:
+                entry.leases -= 1
+                self._evict()
+
+    @contextmanager
+    def lease(self, username, password):
+        '''
+        Lease the session of an account for the duration of a with block.
+
+        Example:
+            with pool.lease(username, password) as scraper:
+                scraper.get_attendance()
+        '''
+        obj = self.acquire(username, password)
+        try:
+            yield obj
+        finally:
+            self.release(username, password)
+
+    def invalidate(self, username, password, obj=None):
+        '''
+        Drop the session of an account, e.g. after a call failed because it expired on the server.
+
+        Args:
+            obj (optional): Only drop the session if it is still this object.
+        '''
+        key = LoginCoordinator.account_key(username, password)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (obj is None or entry.obj is obj):
+                self._remove(key)
+
+    def _rewarm_loop(self):
+        while not self._stop.wait(self.rewarm_interval):
+            self.rewarm()
+
+    def rewarm(self):
+        '''
+        Log in again the sessions that expire soon and were used since they logged in.
+        Returns the number of re-warmed sessions.
+        '''
+        now = time.monotonic()
+        with self._lock:
+            due = [
+                (key, entry.username, entry.password) for key, entry in self._entries.items()
+                if now - entry.created >= self.ttl - self.rewarm_before and entry.last_used > entry.created
+            ]
+
+        count = 0
+        for key, username, password in due:
+            try:
+                obj = self.factory(username, password)
+            except Exception:
+                logger.exception("Re-warming the session of %s failed", username)
+                self.invalidate(username, password)
+                continue
+            with self._lock:
+                entry = self._entries.get(key)
+            if entry is None:
+                continue
+            # Keeps the LRU position, and the new session is only re-warmed again if it gets used
+            self._store(key, username, password, obj, last_used=entry.last_used)
+            with self._lock:
+                self._stats["rewarms"] += 1
+            count += 1
+        return count
+
+    def stats(self):
+        '''
+        Return the number of sessions, their estimated size and the hit, miss, eviction and re-warm counters.
+        '''
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(sessions=len(self._entries), bytes=self._bytes)
+        return stats
+
+    def close(self):
+        '''
+        Stop re-warming and drop all sessions.
+        '''
+        self._stop.set()
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
@@ -0,0 +1,421 @@
+import datetime
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS attendance (
+    account TEXT NOT NULL,
+    snapshot_date TEXT NOT NULL,
+    course_code TEXT NOT NULL,
+    class_type TEXT NOT NULL,
+    course_name TEXT,
+    attendance TEXT,
+    percentage TEXT,
+    semester TEXT,
+    fetched_at TEXT NOT NULL,
+    PRIMARY KEY (account, snapshot_date, course_code, class_type)
+);
+CREATE INDEX IF NOT EXISTS idx_attendance_course ON attendance (account, course_code, snapshot_date);
+
+CREATE TABLE IF NOT EXISTS fees (
+    account TEXT NOT NULL,
+    snapshot_date TEXT NOT NULL,
+    semester TEXT NOT NULL,
+    total_fees TEXT,
+    received_fees TEXT,
+    scholarship_amount TEXT,
+    pending_fees TEXT,
+    fetched_at TEXT NOT NULL,
+    PRIMARY KEY (account, snapshot_date, semester)
+);
+CREATE INDEX IF NOT EXISTS idx_fees_semester ON fees (account, semester, snapshot_date);
+
+CREATE TABLE IF NOT EXISTS results (
+    account TEXT NOT NULL,
+    exam_month_year TEXT NOT NULL,
+    course_code TEXT NOT NULL,
+    padagoggy TEXT NOT NULL,
+    course_name TEXT,
+    credit TEXT,
+    grade TEXT,
+    parent_subject_id TEXT,
+    fetched_at TEXT NOT NULL,
+    PRIMARY KEY (account, exam_month_year, course_code, padagoggy)
+);
+CREATE INDEX IF NOT EXISTS idx_results_course ON results (account, course_code);
+
+CREATE TABLE IF NOT EXISTS result_summary (
+    account TEXT NOT NULL,
+    exam_month_year TEXT NOT NULL,
+    result_date TEXT,
+    program TEXT,
+    total_credits TEXT,
+    credit_earned TEXT,
+    sgpa TEXT,
+    cgpa TEXT,
+    noofbacklog TEXT,
+    student_last_sem TEXT,
+    fetched_at TEXT NOT NULL,
+    PRIMARY KEY (account, exam_month_year)
+);
+
+CREATE TABLE IF NOT EXISTS timetable (
+    account TEXT NOT NULL,
+    tt_date TEXT NOT NULL,
+    tt_time TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    att_taken TEXT,
+    faculty_name TEXT,
+    student_details TEXT,
+    day_type TEXT,
+    fetched_at TEXT NOT NULL,
+    PRIMARY KEY (account, tt_date, tt_time, subject)
+);
+CREATE INDEX IF NOT EXISTS idx_timetable_subject ON timetable (account, subject, tt_date);
+
+CREATE TABLE IF NOT EXISTS result_watermarks (
+    account TEXT NOT NULL,
+    schedule_exam_id TEXT NOT NULL,
+    semester INTEGER NOT NULL,
+    exam_month_year TEXT,
+    fingerprint TEXT NOT NULL,
+    noofbacklog TEXT,
+    fetched_at TEXT NOT NULL,
+    PRIMARY KEY (account, schedule_exam_id)
+);
+
+CREATE TABLE IF NOT EXISTS result_discoveries (
+    account TEXT PRIMARY KEY,
+    discovered_at TEXT NOT NULL
+);
+'''
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec="seconds")
+
+
+def _today():
+    return datetime.date.today().isoformat()
+
+
+def _iso_date(date):
+    '''
+    Convert a 'dd/mm/yyyy' date as used by the university into 'yyyy-mm-dd' so it sorts correctly.
+    '''
+    return datetime.datetime.strptime(date, '%d/%m/%Y').date().isoformat()
+
+
+def _try_iso_date(date):
+    try:
+        return _iso_date(date)
+    except (TypeError, ValueError):
+        return date
+
+
+class HarvestStore:
+    '''
+    Local SQLite store for harvested data.
+
+    Keeps snapshots of attendance and fees per account and date, results per exam, the exams
+    already synced by result_sync and the daily timetable entries from get_attendance_status,
+    so historical questions can be answered without fetching everything again. Every save_*
+    method writes its rows in a single transaction and re-saving the same data replaces the
+    existing rows.
+    '''
+
+    def __init__(self, path="charusat.db"):
+        '''
+        Args:
+            path (str): Path of the SQLite database file, created if it doesn't exist.
+        '''
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.RLock()
+        self._depth = 0
+
+    def close(self):
+        self.conn.close()
+
+    @contextmanager
+    def transaction(self):
+        '''
+        Group several save_* calls into one transaction, e.g. when saving a whole harvest batch.
+        '''
+        with self._lock:
+            self._depth += 1
+            try:
+                if self._depth == 1:
+                    with self.conn:
+                        yield
+                else:
+                    yield
+            finally:
+                self._depth -= 1
+
+    def _write(self, sql, rows):
+        with self.transaction():
+            self.conn.executemany(sql, rows)
+
+    def _query(self, sql, params):
+        with self._lock:
+            return [dict(row) for row in self.conn.execute(sql, params)]
+
+    def save_attendance(self, account, data, snapshot_date=None):
+        '''
+        Save the output of CharusatScraper.get_attendance as the snapshot of a day.
+
+        Args:
+            account (str): The username the data belongs to.
+            data (dict): The parsed attendance data.
+            snapshot_date (str, optional): 'yyyy-mm-dd' date of the snapshot. Defaults to today.
+        '''
+        snapshot_date = snapshot_date or _today()
+        fetched_at = _now()
+        self._write(
+            "INSERT OR REPLACE INTO attendance VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(account, snapshot_date, entry.get("courseCode", ""), entry.get("classType", ""),
+              entry.get("courseName"), entry.get("attendance"), entry.get("percentage"),
+              data.get("semester"), fetched_at) for entry in data.get("data", [])])
+
+    def save_fees(self, account, data, snapshot_date=None):
+        '''
+        Save the output of CharusatScraper.get_fees_details as the snapshot of a day.
+
+        Args:
+            account (str): The username the data belongs to.
+            data (list): The parsed fees data.
+            snapshot_date (str, optional): 'yyyy-mm-dd' date of the snapshot. Defaults to today.
+        '''
+        snapshot_date = snapshot_date or _today()
+        fetched_at = _now()
+        self._write(
+            "INSERT OR REPLACE INTO fees VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(account, snapshot_date, entry.get("semester", ""), entry.get("totalFees"),
+              entry.get("recievedFees"), entry.get("scholarshipAmount"), entry.get("pendingFees"),
+              fetched_at) for entry in data])
+
+    def save_result(self, account, data):
+        '''
+        Save the output of CharusatPrivateAPI.get_result_data.
+
+        Args:
+            account (str): The username the data belongs to.
+            data (dict): The result data with 'result' and 'summary' entries.
+        '''
+        fetched_at = _now()
+        summary = data.get("summary", [])
+        exam_month_year = summary[0].get("examMonthYear", "") if summary else ""
+
+        with self.transaction():
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(account, exam_month_year, entry.get("courseCode", ""), entry.get("padagoggy", ""),
+                  entry.get("courseName"), entry.get("credit"), entry.get("grade"),
+                  entry.get("parentSubjectID"), fetched_at) for entry in data.get("result", [])])
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO result_summary VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(account, entry.get("examMonthYear", ""), _try_iso_date(entry.get("date")), entry.get("program"),
+                  entry.get("totalCredits"), entry.get("creditEarned"), entry.get("sgpa"),
+                  entry.get("cgpa"), entry.get("noofbacklog"), entry.get("studentLastSem"),
+                  fetched_at) for entry in summary])
+
+    def save_result_watermark(self, account, schedule_exam_id, semester, exam_month_year, fingerprint, noofbacklog=None):
+        '''
+        Record that the result of an exam was fetched, see result_sync.sync_results.
+
+        Args:
+            account (str): The username the exam belongs to.
+            schedule_exam_id (str): The ScheduleExamID of the exam.
+            semester (int): The semester whose schedule list contains the exam.
+            exam_month_year (str): The ExamMonthYear of the exam.
+            fingerprint (str): Fingerprint of the exam's schedule entry, to notice changes.
+            noofbacklog (str, optional): The backlogs in the fetched result.
+        '''
+        self._write(
+            "INSERT OR REPLACE INTO result_watermarks VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(account, str(schedule_exam_id), semester, exam_month_year, fingerprint, noofbacklog, _now())])
+
+    def save_result_discovery(self, account):
+        '''
+        Record that all semesters of an account were checked for results, see result_sync.sync_results.
+        '''
+        self._write("INSERT OR REPLACE INTO result_discoveries VALUES (?, ?)", [(account, _now())])
+
+    def save_attendance_status(self, account, rows):
+        '''
+        Save the tblActualTimeTable entries returned by get_attendance_status.
+
+        Args:
+            account (str): The username the data belongs to.
+            rows (list): The timetable entries, their 'TTDate' is used as the date.
+        '''
+        fetched_at = _now()
+        self._write(
+            "INSERT OR REPLACE INTO timetable VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(account, _iso_date(row["TTDate"]), row.get("TTTime", ""), row.get("Subjectdet", ""),
+              row.get("AttTaken"), row.get("FacultyName"), row.get("StudentDetails"),
+              row.get("dayType"), fetched_at) for row in rows if row.get("TTDate")])
+
+    def save(self, method, account, data):
+        '''
+        Save the output of a scraper method by its name, e.g. the results yielded by pipeline.harvest.
+
+        Raises:
+            ValueError: If the method's output can't be stored.
+        '''
+        savers = self._savers()
+        if method not in savers:
+            raise ValueError("Method '{}' can't be stored".format(method))
+        savers[method](account, data)
+
+    def can_save(self, method):
+        '''
+        Return whether the output of a scraper method can be stored with save.
+        '''
+        return method in self._savers()
+
+    def _savers(self):
+        return {
+            "get_attendance": self.save_attendance,
+            "get_fees_details": self.save_fees,
+            "get_result_data": self.save_result,
+            "get_attendance_status": self.save_attendance_status,
+        }
+
+    def save_many(self, records):
+        '''
+        Save many harvested records in a single transaction.
+
+        Args:
+            records (iterable): Dictionaries with 'method', 'username' and 'data' keys, as yielded by
+                pipeline.harvest. Records with an 'error' are skipped, and so are records of methods
+                without a table, such as get_user_details and get_attendance_status_web.
+
+        Returns:
+            int: The number of saved records.
+        '''
+        savers = self._savers()
+        saved = 0
+        with self.transaction():
+            for record in records:
+                if record.get("error") is None and record["method"] in savers:
+                    savers[record["method"]](record["username"], record["data"])
+                    saved += 1
+        return saved
+
+    def attendance_history(self, account, course_code=None, class_type=None, since=None):
+        '''
+        Return the stored attendance snapshots of an account, oldest first.
+
+        Args:
+            account (str): The username.
+            course_code (str, optional): Only return this course.
+            class_type (str, optional): Only return this class type, e.g. "LECT" or "LAB".
+            since (str, optional): Only return snapshots on or after this 'yyyy-mm-dd' date.
+        '''
+        sql = "SELECT * FROM attendance WHERE account = ?"
+        params = [account]
+        for column, value in (("course_code", course_code), ("class_type", class_type)):
+            if value is not None:
+                sql += " AND {} = ?".format(column)
+                params.append(value)
+        if since is not None:
+            sql += " AND snapshot_date >= ?"
+            params.append(since)
+        return self._query(sql + " ORDER BY snapshot_date, course_code, class_type", params)
+
+    def attendance_changes(self, account, from_date, to_date):
+        '''
+        Return the courses whose attendance differs between two snapshots.
+
+        Returns:
+            list: Dictionaries with 'course_code', 'class_type', 'before' and 'after' attendance.
+                Courses missing from one of the snapshots have None on that side.
+        '''
+        sql = '''
+            SELECT a.course_code, a.class_type, a.attendance AS before, b.attendance AS after
+            FROM attendance a LEFT JOIN attendance b
+                ON b.account = a.account AND b.snapshot_date = ?
+                AND b.course_code = a.course_code AND b.class_type = a.class_type
+            WHERE a.account = ? AND a.snapshot_date = ?
+                AND (b.attendance IS NULL OR b.attendance != a.attendance)
+            UNION ALL
+            SELECT b.course_code, b.class_type, NULL, b.attendance
+            FROM attendance b
+            WHERE b.account = ? AND b.snapshot_date = ? AND NOT EXISTS (
+                SELECT 1 FROM attendance a WHERE a.account = b.account AND a.snapshot_date = ?
+                    AND a.course_code = b.course_code AND a.class_type = b.class_type)
+        '''
+        return self._query(sql, [to_date, account, from_date, account, to_date, from_date])
+
+    def fees_history(self, account, semester=None):
+        '''
+        Return the stored fees snapshots of an account, oldest first.
+        '''
+        sql = "SELECT * FROM fees WHERE account = ?"
+        params = [account]
+        if semester is not None:
+            sql += " AND semester = ?"
+            params.append(str(semester))
+        return self._query(sql + " ORDER BY snapshot_date, semester", params)
+
+    def results(self, account, exam_month_year=None):
+        '''
+        Return the stored course results of an account, optionally for one exam only.
+        '''
+        sql = "SELECT * FROM results WHERE account = ?"
+        params = [account]
+        if exam_month_year is not None:
+            sql += " AND exam_month_year = ?"
+            params.append(exam_month_year)
+        return self._query(sql + " ORDER BY exam_month_year, course_code, padagoggy", params)
+
+    def result_summaries(self, account):
+        '''
+        Return the stored result summaries (sgpa, cgpa, backlogs, ...) of an account.
+        '''
+        return self._query(
+            "SELECT * FROM result_summary WHERE account = ? ORDER BY result_date", [account])
+
+    def result_watermarks(self, account):
+        '''
+        Return the exams whose results were synced for an account, by semester.
+        '''
+        return self._query(
+            "SELECT * FROM result_watermarks WHERE account = ? ORDER BY semester, schedule_exam_id", [account])
+
+    def result_discovered_at(self, account):
+        '''
+        Return when all semesters of an account were last checked for results, or None.
+        '''
+        rows = self._query("SELECT discovered_at FROM result_discoveries WHERE account = ?", [account])
+        return rows[0]["discovered_at"] if rows else None
+
+    def timetable(self, account, start=None, end=None, subject=None):
+        '''
+        Return the stored timetable entries of an account.
+
+        Args:
+            account (str): The username.
+            start (str, optional): First 'yyyy-mm-dd' date to include.
+            end (str, optional): Last 'yyyy-mm-dd' date to include.
+            subject (str, optional): Only return entries for this 'Subjectdet' value.
+        '''
+        sql = "SELECT * FROM timetable WHERE account = ?"
+        params = [account]
+        if start is not None:
+            sql += " AND tt_date >= ?"
+            params.append(start)
+        if end is not None:
+            sql += " AND tt_date <= ?"
+            params.append(end)
+        if subject is not None:
+            sql += " AND subject = ?"
+            params.append(subject)
+        return self._query(sql + " ORDER BY tt_date, tt_time", params)
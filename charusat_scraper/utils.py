@@ -3,12 +3,35 @@ from bs4 import BeautifulSoup
 import json
 
 
+# All eGovernance pages are served as UTF-8, so raw response bytes are decoded with it instead of guessing the charset
+PAGE_ENCODING = "utf-8"
+
+
+def make_soup(markup, encoding=PAGE_ENCODING):
+    '''
+    Build a BeautifulSoup tree from HTML given as a string or as raw response bytes.
+
+    Bytes are handed to BeautifulSoup together with the known encoding, which skips
+    charset detection and the intermediate string copy made by response.text.
+
+    Args:
+        markup (str or bytes): The HTML content.
+        encoding (str): The encoding of the bytes.
+
+    Returns:
+        BeautifulSoup: The parsed document.
+    '''
+    if isinstance(markup, bytes):
+        return BeautifulSoup(markup, 'html.parser', from_encoding=encoding)
+    return BeautifulSoup(markup, 'html.parser')
+
+
 def parse_user_info(html):
     '''
     Parse user information from HTML and return it as a dictionary.
 
     Args:
-        html (str): The HTML content containing user information.
+        html (str or bytes): The HTML content containing user information.
 
     Returns:
         dict: A dictionary containing parsed user information with the following keys:
@@ -28,7 +51,7 @@ def parse_user_info(html):
         If any of the fields are not found in the HTML, they won't be included in the
         returned dictionary.
     '''
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = make_soup(html)
 
     data = {}
 
@@ -77,6 +100,22 @@ def parse_user_info(html):
     return data
 
 
+def parse_user_details(html):
+    '''
+    Parse the enrollment page into User information and Previous Exam Details.
+
+    Args:
+        html (str or bytes): The HTML content of the enrollment page.
+
+    Returns:
+        dict: A dictionary with 'user_info' and 'previous_exam_details' keys.
+    '''
+    return {
+        "user_info": parse_user_info(html),
+        "previous_exam_details": parse_previous_exam_details(html)
+    }
+
+
 def to_camel_case(text):
     '''
     Convert a given text into camel case.
@@ -105,12 +144,12 @@ def parse_previous_exam_details(html):
     Parse HTML containing previous exam details and convert it into a list of dictionaries.
 
     Args:
-        html (str): The HTML content to be parsed.
+        html (str or bytes): The HTML content to be parsed.
 
     Returns:
         A JSON-formatted string representing the Previous Exam details.
     '''
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = make_soup(html)
     table = soup.find(
         'table', {'id': 'ctl00_ContentPlaceHolder1_gv_tblEducation'})
 
@@ -139,12 +178,12 @@ def parse_fees_data(html_data):
     Parse HTML containing fees details and convert it into a JSON string.
 
     Args:
-        html_data (str): The HTML content to be parsed.
+        html_data (str or bytes): The HTML content to be parsed.
 
     Returns:
         A JSON-formatted string representing the fees details.
     '''
-    soup = BeautifulSoup(html_data, 'html.parser')
+    soup = make_soup(html_data)
 
     fees_table = soup.find('table', {'id': 'gvfees_details'})
 
@@ -180,13 +219,13 @@ def parse_result_data(html):
     Parse HTML containing student result data and convert it into a JSON string.
 
     Args:
-        html (str): The HTML content to be parsed.
+        html (str or bytes): The HTML content to be parsed.
 
     Returns:
         A JSON-formatted string representing the student's result data.
 
     '''
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = make_soup(html)
     result_data = {}
 
     # Find the table with result data (id='gvresult')
@@ -232,21 +271,29 @@ def parse_result_data(html):
     return result_data
 
 
+def _decode(value, encoding=PAGE_ENCODING):
+    return value.decode(encoding) if isinstance(value, bytes) else value
+
+
 def extract_payload_values_for_results(html):
     pattern = r'__(?P<name>VIEWSTATE|VIEWSTATEGENERATOR|EVENTVALIDATION)\|(?P<value>[^|]+)'
+    if isinstance(html, bytes):
+        pattern = pattern.encode()
     matches = re.finditer(pattern, html)
 
-    result = {match.group('name'): match.group('value') for match in matches}
+    result = {_decode(match.group('name')): _decode(match.group('value')) for match in matches}
 
     return result
 
 
 def extract_payload_values(text):
     pattern = r'<input[^>]*name=("__VIEWSTATEGENERATOR"|"__EVENTVALIDATION"|"__VIEWSTATE")[^>]*value="([^"]*)"'
+    if isinstance(text, bytes):
+        pattern = pattern.encode()
 
     matches = re.findall(pattern, text)
 
-    values = {key.strip('"'): value for key, value in matches}
+    values = {_decode(key).strip('"'): _decode(value) for key, value in matches}
 
     return values
 
@@ -256,12 +303,12 @@ def parse_attendance_status_html(html):
     Parse HTML containing Attendance Status details and convert it into a JSON string.
 
     Args:
-        html_data (str): The HTML content to be parsed.
+        html_data (str or bytes): The HTML content to be parsed.
 
     Returns:
         A JSON-formatted string representing the Time Table details.
     '''
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = make_soup(html)
 
     timetable_table = soup.find('table', {'id': 'gvtimetableDetails'})
 
@@ -307,12 +354,12 @@ def parse_attendance_html(html):
     Parse HTML containing Overall Gross Lecture Attendance details and convert it into a JSON string.
 
     Args:
-        html_data (str): The HTML content to be parsed.
+        html_data (str or bytes): The HTML content to be parsed.
 
     Returns:
         A JSON-formatted string representing the Overall Gross Lecture Attendancedetails.
     '''
-    soup = BeautifulSoup(html, 'html.parser')
+    soup = make_soup(html)
 
     # Find the first table with id "gvGrossAttPop"
     gross_attendance_table = soup.find('table', {'id': 'gvGrossAttPop'})
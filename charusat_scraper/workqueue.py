@@ -0,0 +1,410 @@
+import argparse
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from multiprocessing.managers import BaseManager
+from .scraper import CharusatScraper
+
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account TEXT NOT NULL,
+    method TEXT NOT NULL,
+    args TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    result TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_state ON tasks (state, account);
+
+CREATE TABLE IF NOT EXISTS leases (
+    account TEXT PRIMARY KEY,
+    worker TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_leases_worker ON leases (worker);
+'''
+
+
+class SQLiteWorkQueue:
+    '''
+    Work queue of account/method tasks stored in SQLite, shared by any number of workers.
+
+    Workers lease whole accounts: all tasks of a leased account go to the same worker, so it can
+    reuse one logged in session for them. Leases expire unless the worker keeps sending heartbeats;
+    the tasks of an expired lease go back to the queue and are retried up to max_attempts times.
+
+    The database can be used directly by processes on one machine, or served to other nodes with serve_queue.
+    '''
+
+    def __init__(self, path="workqueue.db"):
+        '''
+        Args:
+            path (str): Path of the SQLite database file, created if it doesn't exist.
+        '''
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def _transaction(self, func):
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(self.conn)
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return result
+
+    def enqueue(self, account, method, args=None, max_attempts=3):
+        '''
+        Add a task and return its id.
+
+        Args:
+            account (str): The username the task runs for.
+            method (str): The scraper method to call, e.g. "get_attendance".
+            args (dict, optional): Keyword arguments for the method.
+            max_attempts (int): How many times the task is tried before it is marked as failed.
+        '''
+        return self.enqueue_many([(account, method, args)], max_attempts=max_attempts)[0]
+
+    def enqueue_many(self, tasks, max_attempts=3):
+        '''
+        Add many (account, method, args) tasks in one transaction and return their ids.
+        '''
+        def insert(conn):
+            now = time.time()
+            return [conn.execute(
+                "INSERT INTO tasks (account, method, args, max_attempts, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (account, method, json.dumps(args or {}), max_attempts, now)).lastrowid
+                for account, method, args in tasks]
+        return self._transaction(insert)
+
+    def lease(self, worker, lease_seconds=60, max_tasks=50):
+        '''
+        Lease an account with pending tasks and return up to max_tasks of its tasks.
+
+        Accounts already leased by the worker are preferred, so an account stays on the same
+        worker while it has tasks. Leases of accounts without remaining tasks are released.
+
+        Returns:
+            list: Dictionaries with 'id', 'account', 'method', 'args' and 'attempts', empty if there is no work.
+        '''
+        def claim(conn):
+            now = time.time()
+
+            # Return the tasks of expired leases to the queue, or give up on them
+            conn.execute(
+                "UPDATE tasks SET state = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END, "
+                "worker = NULL, error = COALESCE(error, 'Lease expired'), updated_at = ? "
+                "WHERE state = 'leased' AND account IN (SELECT account FROM leases WHERE expires < ?)", (now, now))
+            conn.execute("DELETE FROM leases WHERE expires < ?", (now,))
+            conn.execute(
+                "DELETE FROM leases WHERE worker = ? AND account NOT IN "
+                "(SELECT account FROM tasks WHERE state IN ('pending', 'leased'))", (worker,))
+
+            row = conn.execute(
+                "SELECT t.account FROM tasks t LEFT JOIN leases l ON l.account = t.account "
+                "WHERE t.state = 'pending' AND (l.account IS NULL OR l.worker = ?) "
+                "ORDER BY l.worker IS NULL, t.id LIMIT 1", (worker,)).fetchone()
+            if row is None:
+                return []
+            account = row["account"]
+
+            conn.execute(
+                "INSERT OR REPLACE INTO leases (account, worker, expires) VALUES (?, ?, ?)",
+                (account, worker, now + lease_seconds))
+            tasks = conn.execute(
+                "SELECT id, account, method, args, attempts FROM tasks "
+                "WHERE account = ? AND state = 'pending' ORDER BY id LIMIT ?", (account, max_tasks)).fetchall()
+            conn.executemany(
+                "UPDATE tasks SET state = 'leased', worker = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                [(worker, now, task["id"]) for task in tasks])
+
+            return [{
+                "id": task["id"],
+                "account": task["account"],
+                "method": task["method"],
+                "args": json.loads(task["args"]),
+                "attempts": task["attempts"] + 1,
+            } for task in tasks]
+
+        return self._transaction(claim)
+
+    def heartbeat(self, worker, lease_seconds=60):
+        '''
+        Extend every lease held by the worker and return how many were extended.
+        '''
+        return self._transaction(lambda conn: conn.execute(
+            "UPDATE leases SET expires = ? WHERE worker = ?", (time.time() + lease_seconds, worker)).rowcount)
+
+    def complete(self, worker, task_id, result=None):
+        '''
+        Mark a task leased by the worker as done, storing its JSON serializable result.
+
+        Returns:
+            bool: False if the worker no longer holds the task, e.g. because its lease expired and
+                the task was leased again. The result is dropped then.
+        '''
+        return self._transaction(lambda conn: conn.execute(
+            "UPDATE tasks SET state = 'done', result = ?, error = NULL, updated_at = ? "
+            "WHERE id = ? AND worker = ? AND state = 'leased'",
+            (json.dumps(result), time.time(), task_id, worker)).rowcount > 0)
+
+    def fail(self, worker, task_id, error):
+        '''
+        Record a failed attempt of a task leased by the worker. It goes back to the queue unless it used up its attempts.
+
+        Returns:
+            bool: False if the worker no longer holds the task, which is left as it is.
+        '''
+        return self._transaction(lambda conn: conn.execute(
+            "UPDATE tasks SET state = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'pending' END, "
+            "worker = NULL, error = ?, updated_at = ? WHERE id = ? AND worker = ? AND state = 'leased'",
+            (str(error), time.time(), task_id, worker)).rowcount > 0)
+
+    def release(self, worker, account):
+        '''
+        Release a worker's lease on an account, e.g. when the worker shuts down.
+        '''
+        def release_account(conn):
+            conn.execute(
+                "UPDATE tasks SET state = 'pending', worker = NULL, attempts = attempts - 1, updated_at = ? "
+                "WHERE account = ? AND worker = ? AND state = 'leased'", (time.time(), account, worker))
+            conn.execute("DELETE FROM leases WHERE account = ? AND worker = ?", (account, worker))
+        self._transaction(release_account)
+
+    def results(self, account=None, state="done"):
+        '''
+        Return the tasks in a state, with their decoded results, optionally for one account only.
+        '''
+        sql = "SELECT id, account, method, args, state, attempts, result, error FROM tasks WHERE state = ?"
+        params = [state]
+        if account is not None:
+            sql += " AND account = ?"
+            params.append(account)
+        with self._lock:
+            rows = self.conn.execute(sql + " ORDER BY id", params).fetchall()
+        return [dict(row, args=json.loads(row["args"]), result=json.loads(row["result"]) if row["result"] else None) for row in rows]
+
+    def stats(self):
+        '''
+        Return the number of tasks in each state.
+        '''
+        with self._lock:
+            rows = self.conn.execute("SELECT state, COUNT(*) FROM tasks GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+
+class QueueManager(BaseManager):
+    pass
+
+
+def serve_queue(path, address=("127.0.0.1", 50000), authkey=None):
+    '''
+    Serve a SQLiteWorkQueue to workers on other nodes, acting as a small stand-in broker.
+
+    Blocks until the process is stopped. Workers connect with connect_queue.
+
+    The connection uses multiprocessing's pickle protocol: anyone with the authkey can run code on
+    the broker, and task results travel unencrypted. Use a long random authkey and only listen on a
+    private network, or reach the broker through an SSH tunnel or VPN.
+
+    Args:
+        path (str): Path of the queue database.
+        address (tuple): (host, port) to listen on.
+        authkey (bytes): Shared secret of the broker and its workers.
+
+    Raises:
+        ValueError: If no authkey is given.
+    '''
+    if not authkey:
+        raise ValueError("An authkey is required to serve the queue")
+    work_queue = SQLiteWorkQueue(path)
+    QueueManager.register("get_queue", callable=lambda: work_queue)
+    manager = QueueManager(address=address, authkey=authkey)
+    manager.get_server().serve_forever()
+
+
+def connect_queue(address=("127.0.0.1", 50000), authkey=None):
+    '''
+    Connect to a queue served by serve_queue and return a proxy with the SQLiteWorkQueue methods.
+
+    Raises:
+        ValueError: If no authkey is given.
+    '''
+    if not authkey:
+        raise ValueError("The authkey of the queue is required to connect")
+    QueueManager.register("get_queue")
+    manager = QueueManager(address=address, authkey=authkey)
+    manager.connect()
+    return manager.get_queue()
+
+
+class HarvestWorker:
+    '''
+    Drains a work queue by calling scraper methods for the leased accounts.
+
+    Each account is logged in once and its scraper is reused for all of its tasks. Leases are
+    kept alive by a heartbeat thread while the worker runs.
+    '''
+
+    def __init__(self, work_queue, credentials, worker_id=None, lease_seconds=60, max_sessions=32, on_result=None, scraper_class=CharusatScraper):
+        '''
+        Args:
+            work_queue (SQLiteWorkQueue): The queue, or a proxy returned by connect_queue.
+            credentials (dict or callable): Account -> password, so passwords never have to be stored in the queue.
+            worker_id (str, optional): Unique name of the worker. Defaults to host, process id and a random suffix.
+            lease_seconds (float): How long a lease lasts without heartbeats.
+            max_sessions (int): Number of logged in scrapers kept for reuse.
+            on_result (callable, optional): on_result(account, method, data) called for every finished task,
+                e.g. HarvestStore.save with the arguments reordered.
+            scraper_class (type): Class used to log in accounts.
+        '''
+        self.queue = work_queue
+        self.credentials = credentials if callable(credentials) else credentials.get
+        self.worker_id = worker_id or "{}-{}-{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:6])
+        self.lease_seconds = lease_seconds
+        self.max_sessions = max_sessions
+        self.on_result = on_result
+        self.scraper_class = scraper_class
+        self._scrapers = OrderedDict()
+
+    def _get_scraper(self, account):
+        scraper = self._scrapers.pop(account, None)
+        if scraper is None:
+            password = self.credentials(account)
+            if password is None:
+                raise KeyError("No credentials for account '{}'".format(account))
+            scraper = self.scraper_class(account, password)
+        self._scrapers[account] = scraper
+        while len(self._scrapers) > self.max_sessions:
+            self._scrapers.popitem(last=False)
+        return scraper
+
+    def _heartbeat(self, stop):
+        while not stop.wait(self.lease_seconds / 3):
+            try:
+                self.queue.heartbeat(self.worker_id, self.lease_seconds)
+            except Exception:
+                logger.exception("Heartbeat of %s failed", self.worker_id)
+
+    def run_task(self, task):
+        '''
+        Run one leased task and record its outcome in the queue.
+        '''
+        if not task["method"].startswith("get_"):
+            self.queue.fail(self.worker_id, task["id"], "Method '{}' is not allowed".format(task["method"]))
+            return
+        try:
+            scraper = self._get_scraper(task["account"])
+            data = getattr(scraper, task["method"])(**task["args"])
+        except Exception as e:
+            # The session may have expired, log in again on the next attempt
+            self._scrapers.pop(task["account"], None)
+            self.queue.fail(self.worker_id, task["id"], "{}: {}".format(type(e).__name__, e))
+            return
+
+        if self.on_result is not None:
+            try:
+                self.on_result(task["account"], task["method"], data)
+            except Exception as e:
+                logger.exception("Storing the result of task %s failed", task["id"])
+                self.queue.fail(self.worker_id, task["id"], "on_result {}: {}".format(type(e).__name__, e))
+                return
+        self.queue.complete(self.worker_id, task["id"], data)
+
+    def run(self, stop=None, idle_sleep=2.0, exit_when_empty=False):
+        '''
+        Lease and run tasks until the stop event is set.
+
+        Args:
+            stop (threading.Event, optional): Event that ends the loop when set.
+            idle_sleep (float): Seconds to wait when there is no work.
+            exit_when_empty (bool): Return as soon as there is no work instead of waiting for more.
+        '''
+        stop = stop or threading.Event()
+        heartbeat_stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(heartbeat_stop,), daemon=True)
+        heartbeat.start()
+        # Every leased account, also those whose scraper was dropped or never created
+        accounts = set()
+
+        try:
+            while not stop.is_set():
+                tasks = self.queue.lease(self.worker_id, self.lease_seconds)
+                accounts.update(task["account"] for task in tasks)
+                if not tasks:
+                    if exit_when_empty:
+                        break
+                    stop.wait(idle_sleep)
+                    continue
+                for task in tasks:
+                    if stop.is_set():
+                        break
+                    self.run_task(task)
+        finally:
+            heartbeat_stop.set()
+            for account in accounts:
+                self.queue.release(self.worker_id, account)
+
+
+def _address(text):
+    host, _, port = text.rpartition(":")
+    return (host or "127.0.0.1", int(port))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distributed harvesting with a leased work queue")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve = subparsers.add_parser("serve", help="Serve a queue database to workers on other nodes")
+    serve.add_argument("--db", default="workqueue.db")
+    serve.add_argument("--listen", default="127.0.0.1:50000", help="host:port to listen on")
+    serve.add_argument("--authkey", default=os.environ.get("CHARUSAT_QUEUE_AUTHKEY"),
+                       help="Shared secret of the broker and its workers, defaults to $CHARUSAT_QUEUE_AUTHKEY")
+
+    work = subparsers.add_parser("work", help="Run a worker")
+    source = work.add_mutually_exclusive_group(required=True)
+    source.add_argument("--db", help="Use a local queue database")
+    source.add_argument("--connect", help="host:port of a queue served with 'serve'")
+    work.add_argument("--authkey", default=os.environ.get("CHARUSAT_QUEUE_AUTHKEY"),
+                      help="Shared secret of the broker, defaults to $CHARUSAT_QUEUE_AUTHKEY")
+    work.add_argument("--credentials", required=True, help="JSON file mapping usernames to passwords")
+    work.add_argument("--exit-when-empty", action="store_true")
+
+    args = parser.parse_args()
+
+    if not args.authkey and (args.command == "serve" or args.connect):
+        parser.error("--authkey or CHARUSAT_QUEUE_AUTHKEY is required")
+
+    if args.command == "serve":
+        serve_queue(args.db, _address(args.listen), args.authkey.encode())
+        return
+
+    work_queue = SQLiteWorkQueue(args.db) if args.db else connect_queue(_address(args.connect), args.authkey.encode())
+    with open(args.credentials, "r", encoding="utf-8") as fh:
+        credentials = json.load(fh)
+    HarvestWorker(work_queue, credentials).run(exit_when_empty=args.exit_when_empty)
+
+
+if __name__ == "__main__":
+    main()
@@ -23,6 +23,9 @@ setuptools.setup(
         "requests",
         "beautifulsoup4"
     ],
+    extras_require={
+        "fast": ["orjson", "msgspec"]
+    },
     packages=setuptools.find_packages(),
-    python_requires=">=3.6",
+    python_requires=">=3.7",
 )
\ No newline at end of file